@@ -0,0 +1,292 @@
+"""
+Offline benchmark of the Process1 (predict8_ver4.py) and Process2 (detect_Face3.py) pipelines.
+
+Builds a synthetic corpus that mirrors the real mix (Full/Half file names, images below, near and above 8.2MP, 0/1/many
+persons pasted from person crops of the sample images) and runs both pipelines end to end on it, each in its own
+process. Reports images/sec, per-stage latency percentiles (from the Spans stage timer), peak RSS and the O/X decision
+counts to a JSON file. Pass {"trace": true} in --p1-args/--p2-args to also get a Chrome trace of a run.
+
+With --backends the same corpus is run once per inference backend (pt = PyTorch, onnx = ONNX Runtime, dnn = OpenCV
+DNN on the same .onnx, exported with export_onnx.py when missing) and every backend's O/X decisions are compared with
+the first one. The fastest backend that agrees can then be picked per model (--dnn / --face-dnn in predict8_ver4.py).
+
+Usage:
+    $ python benchmark.py --weights yolov5l-seg.pt --face-weights face_detection_yolov5s.pt --images 200
+    $ python benchmark.py --weights yolov5l-seg.pt --images 200 --p1-args '{"headless": true, "prefetch": 4}'
+    $ python benchmark.py --weights yolov5l-seg.pt --face-weights face_detection_yolov5s.pt --backends pt onnx dnn
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from models.common import DetectMultiBackend
+from utils.dataloaders import LoadImages
+from utils.general import LOGGER, cv2, increment_path, non_max_suppression, print_args, scale_boxes
+from utils.torch_utils import select_device
+
+from export_onnx import export_model
+from predict8_ver4 import MIN_PIXEL
+
+# 이미지 크기 구간: x2 업스케일로도 부족 / 업스케일 필요 / 820만 픽셀 경계 바로 아래, 위 / 충분히 큼
+SIZES = {
+    "below": 1_500_000,
+    "upscale": 2_400_000,
+    "near_below": MIN_PIXEL - 200_000,
+    "near_above": MIN_PIXEL + 200_000,
+    "above": 12_000_000,
+}
+PERSONS = (0, 1, 1, 2)  # 이미지당 사람 수, 1명이 가장 흔함
+BACKENDS = ("pt", "onnx", "dnn")  # PyTorch, ONNX Runtime, OpenCV DNN
+
+
+@torch.no_grad()
+def person_crops(weights, source, imgsz=640, device="cpu", conf_thres=0.5, min_height=100):
+    """Cuts person boxes out of the sample images with the seg model, to be pasted into synthetic images."""
+    model = DetectMultiBackend(weights, device=select_device(device))
+    person = [k for k, v in model.names.items() if v == "person"]
+    crops = []
+    for path, im, im0, _, _ in LoadImages(source, img_size=imgsz, stride=model.stride, auto=model.pt):
+        im = torch.from_numpy(im).to(model.device).float()[None] / 255
+        det = non_max_suppression(model(im)[0], conf_thres, 0.45, person, max_det=100, nm=32)[0]
+        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
+        for x1, y1, x2, y2 in det[:, :4].int().tolist():
+            if y2 - y1 >= min_height:
+                crops.append(im0[y1:y2, x1:x2].copy())
+    assert crops, f"no person crops found in {source}"
+    return crops
+
+
+def synth_image(rng, crops, width, height, persons, height_ratio):
+    """Draws a noisy gradient background and pastes `persons` person crops, the first `height_ratio` * height tall."""
+    shade = np.linspace(0.6, 1.0, height, dtype=np.float32)[:, None, None] * rng.integers(60, 200, 3)
+    im = np.broadcast_to(shade, (height, width, 3)).astype(np.uint8)
+    im += rng.integers(0, 8, (height, width, 3), dtype=np.uint8)
+    for k in range(persons):
+        crop = crops[rng.integers(len(crops))]
+        h = int(height * (height_ratio if k == 0 else 0.35))
+        w = min(width, max(1, crop.shape[1] * h // crop.shape[0]))
+        x = int(rng.integers(0, width - w + 1))
+        y = height - h - int(rng.integers(0, (height - h) // 4 + 1))
+        im[y : y + h, x : x + w] = cv2.resize(crop, (w, h), interpolation=cv2.INTER_LINEAR)
+    return im
+
+
+def make_corpus(corpus_dir, crops, n=100, seed=0):
+    """Writes `n` synthetic JPEGs cycling through Full/Half, SIZES and PERSONS, or reuses an existing corpus."""
+    corpus_dir = Path(corpus_dir)
+    if len(list(corpus_dir.glob("*.jpg"))) == n:
+        return corpus_dir
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        kind = ("Full", "Half")[i % 2]
+        bucket = list(SIZES)[(i // 2) % len(SIZES)]
+        persons = PERSONS[(i // (2 * len(SIZES))) % len(PERSONS)]
+        width = int((SIZES[bucket] * 3 / 4) ** 0.5)  # 3:4 세로 이미지
+        height = SIZES[bucket] // width
+        height_ratio = 0.9 if kind == "Half" else (0.7, 0.35)[i // 4 % 2]  # Full은 키 조건 성공/실패 모두 포함
+        im = synth_image(rng, crops, width, height, persons, height_ratio)
+        cv2.imwrite(str(corpus_dir / f"{i:05d}_{kind}_{bucket}_{persons}p.jpg"), im, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return corpus_dir
+
+
+def run_pipeline(module, kwargs, queue):
+    """Runs one pipeline's run() in this (spawned) process and reports wall time, per-image spans and peak RSS."""
+    import importlib
+
+    run = importlib.import_module(module).run
+    timings = []
+    t0 = time.perf_counter()
+    try:
+        run(**kwargs, timings=timings)
+    except Exception:
+        queue.put({"error": traceback.format_exc()})  # queue.get()이 멈추지 않도록 항상 결과를 보냄
+        return
+    wall = time.perf_counter() - t0
+    rss = max(resource.getrusage(r).ru_maxrss for r in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    queue.put({"wall_s": wall, "timings": timings, "peak_rss_mb": rss / 1024})  # ru_maxrss는 KB (Linux)
+
+
+def percentiles(x):
+    """Returns mean/p50/p90/p99 of a list of latencies in ms."""
+    if not len(x):
+        return {}
+    p50, p90, p99 = np.percentile(x, (50, 90, 99))
+    return {"mean": float(np.mean(x)), "p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+
+def summarize(result, csv_path):
+    """Turns the raw result of run_pipeline() into throughput, stage percentiles and decision counts."""
+    timings = result.pop("timings")
+    done = sorted(t["done"] for t in timings)
+    steady = (len(done) - 1) / (done[-1] - done[0]) if len(done) > 1 and done[-1] > done[0] else None
+    names = list(dict.fromkeys(k for t in timings for k in t if k not in ("file", "done")))  # Spans 단계, 등장 순서
+    stages = {k: percentiles([t.get(k, 0.0) for t in timings]) for k in names}
+    stages["total"] = percentiles([sum(t.get(k, 0.0) for k in names) for t in timings])
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.DictReader(f))
+    return {
+        "images": len(rows),
+        "wall_s": result["wall_s"],
+        "images_per_sec": len(rows) / result["wall_s"],  # model load 포함
+        "steady_images_per_sec": steady,  # 첫 이미지 완료 이후
+        "peak_rss_mb": result["peak_rss_mb"],
+        "stages_ms": stages,
+        "decisions": dict(Counter(r["Success"] for r in rows)),
+        "notes": dict(Counter(r["Note"] for r in rows)) if rows and "Note" in rows[0] else {},
+    }
+
+
+def bench(module, kwargs, csv_path):
+    """Runs a pipeline in a fresh spawned process so its peak RSS and imports are isolated, and summarizes it."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_pipeline, args=(module, kwargs, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    if "error" in result:
+        LOGGER.warning(f"WARNING ⚠️ {module} failed:\n{result['error']}")
+        return result
+    return summarize(result, csv_path)
+
+
+def backend_weights(weights, backend, imgsz):
+    """Returns the model path for `backend`, exporting the .pt model to ONNX next to it if there is no .onnx yet."""
+    w = Path(weights[0] if isinstance(weights, (list, tuple)) else weights)
+    if backend == "pt" or w.suffix == ".onnx":
+        return w
+    f = w.with_suffix(".onnx")
+    return f if f.exists() else export_model(w, imgsz)
+
+
+def read_decisions(csv_path):
+    """Returns {file name: (Success, Note)} of a result CSV, empty if the run wrote none."""
+    if not Path(csv_path).exists():
+        return {}
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        return {r["File_name"]: (r["Success"], r.get("Note", "")) for r in csv.DictReader(f)}
+
+
+def agreement(base, other):
+    """Compares two backends' decisions per file, returning the agreement rate and the flipped files."""
+    files = sorted(base.keys() | other.keys())
+    flips = [{"file": f, "base": base.get(f), "other": other.get(f)} for f in files if base.get(f) != other.get(f)]
+    return {"images": len(files), "agree": 1 - len(flips) / len(files) if files else None, "flips": flips}
+
+
+def run(
+    weights=ROOT / "yolov5l-seg.pt",  # seg model path(s)
+    face_weights=None,  # face model path, Process2 is skipped if None
+    person_source=ROOT / "data/images",  # images to cut person crops from
+    images=100,  # synthetic corpus size
+    seed=0,  # corpus random seed
+    imgsz=(640, 640),  # inference size (height, width)
+    conf_thres=0.4,  # confidence threshold (both models)
+    device="cpu",  # cuda device, i.e. 0 or cpu
+    project=ROOT / "runs/benchmark",  # save results to project/name
+    name="exp",  # save results to project/name
+    exist_ok=False,  # existing project/name ok, do not increment
+    p1_args=None,  # extra predict8_ver4.run kwargs, e.g. {"headless": True}
+    p2_args=None,  # extra detect_Face3.run kwargs
+    backends=("pt",),  # inference backends to compare, any of BACKENDS, decisions compared with the first
+):
+    """Generates (or reuses) the synthetic corpus, benchmarks both pipelines per backend and writes benchmark.json."""
+    save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    corpus = Path(project) / f"corpus_{images}_{seed}"
+    LOGGER.info(f"Building synthetic corpus in {corpus}")
+    make_corpus(corpus, person_crops(weights, person_source, imgsz[0], device), images, seed)
+
+    config = dict(images=images, seed=seed, imgsz=list(imgsz), conf_thres=conf_thres, device=device)
+    config.update(weights=str(weights), face_weights=str(face_weights), p1_args=p1_args or {}, p2_args=p2_args or {})
+    config.update(backends=list(backends))
+    report = {"config": config, "backends": {}, "agreement": {}}
+    decisions = {}
+    for backend in backends:
+        process_dir = save_dir / backend / "Process"  # backend마다 별도 출력 (결정 비교용)
+        p1_csv = process_dir / "Process1/class_height_whole_files.csv"
+        p2_csv = process_dir / "Process2/face_size_half_whole.csv"
+        common = dict(imgsz=imgsz, conf_thres=conf_thres, device=device, project=save_dir / backend, exist_ok=True)
+        common.update(dnn=backend == "dnn", process_dir=process_dir)
+        p1 = dict(common, weights=backend_weights(weights, backend, imgsz), source=corpus, name="process1")
+        p1.update(save_txt=True, save_crop=True)  # readme의 Process1 실행 옵션과 동일
+        r = {"process1": bench("predict8_ver4", dict(p1, **(p1_args or {})), p1_csv), "process2": None}
+        half_success = process_dir / "Process1/half_class_success"
+        if face_weights and any(half_success.glob("*")):  # face weights 없음 또는 Half 성공 이미지 없음이면 생략
+            p2 = dict(common, weights=backend_weights(face_weights, backend, imgsz), source=half_success)
+            r["process2"] = bench("detect_Face3", dict(p2, name="process2", **(p2_args or {})), p2_csv)
+        report["backends"][backend] = r
+        decisions[backend] = {"process1": read_decisions(p1_csv), "process2": read_decisions(p2_csv)}
+    for backend in backends[1:]:
+        report["agreement"][backend] = {
+            k: agreement(decisions[backends[0]][k], decisions[backend][k]) for k in ("process1", "process2")
+        }
+
+    out = save_dir / "benchmark.json"
+    out.write_text(json.dumps(report, indent=2))
+    for backend, r in report["backends"].items():
+        for k in ("process1", "process2"):
+            if r[k] and "error" not in r[k]:
+                p50 = r[k]["stages_ms"]["total"].get("p50", 0)
+                LOGGER.info(
+                    f"{backend} {k}: {r[k]['images']} images, {r[k]['images_per_sec']:.2f} img/s, p50 {p50:.1f}ms, "
+                    f"peak RSS {r[k]['peak_rss_mb']:.0f}MB"
+                )
+    for backend, a in report["agreement"].items():
+        for k in ("process1", "process2"):
+            if a[k]["images"]:
+                LOGGER.info(f"{backend} vs {backends[0]} {k}: {a[k]['agree']:.2%} agree, {len(a[k]['flips'])} flips")
+    LOGGER.info(f"Benchmark saved to {out}")
+    return report
+
+
+def parse_opt():
+    """Parses command-line options for the offline pipeline benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", type=str, default=ROOT / "yolov5l-seg.pt", help="seg model path(s)")
+    parser.add_argument("--face-weights", nargs="+", type=str, default=None, help="face model path(s) for Process2")
+    parser.add_argument("--person-source", default=ROOT / "data/images", help="images to cut person crops from")
+    parser.add_argument("--images", type=int, default=100, help="synthetic corpus size")
+    parser.add_argument("--seed", type=int, default=0, help="corpus random seed")
+    parser.add_argument("--imgsz", "--img", "--img-size", nargs="+", type=int, default=[640], help="inference size h,w")
+    parser.add_argument("--conf-thres", type=float, default=0.4, help="confidence threshold")
+    parser.add_argument("--device", default="cpu", help="cuda device, i.e. 0 or cpu")
+    parser.add_argument("--project", default=ROOT / "runs/benchmark", help="save results to project/name")
+    parser.add_argument("--name", default="exp", help="save results to project/name")
+    parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
+    parser.add_argument("--p1-args", type=json.loads, default=None, help="JSON dict of extra predict8_ver4.run args")
+    parser.add_argument("--p2-args", type=json.loads, default=None, help="JSON dict of extra detect_Face3.run args")
+    parser.add_argument("--backends", nargs="+", default=["pt"], choices=BACKENDS, help="inference backends to compare")
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Runs the benchmark with the parsed options."""
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -27,12 +27,12 @@ Usage - formats:
                                  yolov5s_edgetpu.tflite     # TensorFlow Edge TPU
                                  yolov5s_paddle_model       # PaddlePaddle
 """
-import pandas as pd
 import argparse
 import csv
 import os
 import platform
 import sys
+import time
 from pathlib import Path
 import numpy as np
 import cv2
@@ -47,6 +47,7 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 from ultralytics.utils.plotting import Annotator, colors, save_one_box
 
 from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
 from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
 from utils.general import (
     LOGGER,
@@ -66,6 +67,52 @@ from utils.general import (
 )
 from utils.torch_utils import select_device, smart_inference_mode
 
+from process_utils import ImageWriter, PrefetchImages, ResultWriter, Spans
+from rules import MIN_FACE_PIXEL, PROCESS2, evaluate, image_columns
+
+def detect_faces(
+    model, im0, imgsz=(640, 640), conf_thres=0.25, iou_thres=0.45, classes=None, agnostic_nms=False, max_det=1000
+):
+    """Runs the face model on an in-memory BGR image and returns its detections scaled to the image size."""
+    im = letterbox(im0, imgsz, stride=model.stride, auto=model.pt)[0]  # padded resize
+    im = np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])  # HWC to CHW, BGR to RGB
+    im = torch.from_numpy(im).to(model.device)
+    im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
+    im /= 255  # 0 - 255 to 0.0 - 1.0
+    pred = model(im[None])
+    det = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)[0]
+    det[:, :4] = scale_boxes(im.shape[1:], det[:, :4], im0.shape).round()
+    return det
+
+
+def face_condition(det, names, min_face_pixel=MIN_FACE_PIXEL):
+    """Applies the Process2 rules (exactly one Face with box area >= min_face_pixel), returns (success, note, pixel)."""
+    areas = [((x2 - x1) * (y2 - y1)).item() for x1, y1, x2, y2, conf, cls in det[:, :6] if names[int(cls)] == "Face"]
+    cols = image_columns(face_count=len(areas), face_area=areas[0] if areas else np.nan)
+    success, note, _ = evaluate(PROCESS2, cols, min_face_pixel=min_face_pixel)
+    return success[0].item(), note[0].item(), str(areas[0]) if areas else "-"
+
+
+def face_rule_nms(names, classes=None, max_det=1000):
+    """
+    Returns the NMS class filter and detection cap that decide the Process2 rule exactly.
+
+    face_condition only looks at Face boxes, and any second Face already fails it while its pixel value comes from the
+    top-scoring Face. NMS offsets boxes by class, so dropping other classes before NMS cannot change which Face boxes
+    survive, and keeping the top 2 is enough.
+
+    Args:
+        names (dict[int, str] | list[str]): Class names of the face model.
+        classes (list[int] | None): User class filter to intersect with. Default is None.
+        max_det (int): User detection cap. Default is 1000.
+
+    Returns:
+        (tuple[list[int], int]): Class filter and maximum number of detections for non_max_suppression.
+    """
+    names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else names
+    rule = [k for k, v in names.items() if v == "Face" and (classes is None or k in classes)]
+    return rule, min(max_det, 2)
+
 
 @smart_inference_mode()
 def run(
@@ -97,6 +144,16 @@ def run(
     half=False,  # use FP16 half-precision inference
     dnn=False,  # use OpenCV DNN for ONNX inference
     vid_stride=1,  # video frame-rate stride
+    save_parquet=False,  # also write the result CSVs as Parquet
+    prefetch=0,  # decode/letterbox images on this many background workers (0 = LoadImages in the main thread)
+    prefetch_processes=False,  # use a process pool instead of a thread pool for --prefetch
+    write_workers=0,  # encode/write routed images on this many background threads (0 = inline)
+    route="png",  # save unmodified originals as 'png' (re-encode), 'link' (hardlink/reflink/copy) or 'move' (rename)
+    process_dir="/content/yolov5/Police_assignment/Process",  # Process2 output root (dirs and CSVs)
+    spans=False,  # write per-image stage timings to save_dir/spans.jsonl
+    trace=False,  # write a Chrome trace timeline of all stages to save_dir/trace.json
+    timings=None,  # list to append the per-image stage timing records to, e.g. for benchmark.py
+    rule_nms=False,  # restrict NMS to the Face class and 2 detections, exact for the Process2 decision
 ):
     """
     Runs YOLOv5 detection inference on various sources like images, videos, directories, streams, etc.
@@ -133,6 +190,24 @@ def run(
         half (bool): If True, use FP16 half-precision inference. Default is False.
         dnn (bool): If True, use OpenCV DNN backend for ONNX inference. Default is False.
         vid_stride (int): Stride for processing video frames, to skip frames between processing. Default is 1.
+        save_parquet (bool): If True, also write the whole/failed result CSVs as Parquet. Default is False.
+        prefetch (int): Number of background workers that decode and letterbox images ahead of inference. 0 keeps
+            LoadImages decoding in the main thread. Default is 0.
+        prefetch_processes (bool): If True, use a process pool instead of a thread pool for prefetch. Default is False.
+        write_workers (int): Number of background threads that encode and write routed images. 0 writes inline.
+            Default is 0.
+        route (str): How unmodified originals are saved to the success/fail directories: 'png' re-encodes them,
+            'link' places the source file by hardlink, reflink or byte copy, 'move' renames it. Default is 'png'.
+        process_dir (str | Path): Root directory of the Process2 success/fail directories and result CSVs. Default is
+            '/content/yolov5/Police_assignment/Process'.
+        spans (bool): If True, write one JSON line of per-stage timings in milliseconds (decode, pre-process,
+            inference, NMS, annotate, rules, encode/route, bookkeeping) per image to save_dir/spans.jsonl. Default is
+            False.
+        trace (bool): If True, write a Chrome trace timeline of every stage to save_dir/trace.json. Default is False.
+        timings (list | None): If a list, the per-image stage timing records are also appended to it. Default is None.
+        rule_nms (bool): If True, run NMS only on the Face class and keep at most 2 detections (see face_rule_nms).
+            The O/X decision and Current pixel are unchanged, but labels and annotated images only show the top 2
+            faces. Ignored with agnostic_nms. Default is False.
 
     Returns:
         None
@@ -166,6 +241,9 @@ def run(
     model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz, s=stride)  # check image size
+    if rule_nms and not agnostic_nms:  # agnostic NMS는 다른 class box끼리도 억제하므로 제외
+        classes, max_det = face_rule_nms(names, classes, max_det)
+        LOGGER.info(f"Rule-aware NMS: classes={classes}, max_det={max_det}")
 
     # Dataloader
     bs = 1  # batch_size
@@ -175,6 +253,10 @@ def run(
         bs = len(dataset)
     elif screenshot:
         dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
+    elif prefetch:
+        dataset = PrefetchImages(
+            source, img_size=imgsz, stride=stride, auto=pt, workers=prefetch, processes=prefetch_processes
+        )
     else:
         dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
     vid_path, vid_writer = [None] * bs, [None] * bs
@@ -182,10 +264,30 @@ def run(
     # Run inference
     model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
     seen, windows, dt = 0, [], (Profile(device=device), Profile(device=device), Profile(device=device))
-    df = pd.DataFrame(columns=["File_name", "Success", "Current pixel"])
+    process_dir = Path(process_dir)
+    csv_file_path = process_dir / 'Process2/face_size_half_whole.csv'  # 원하는 CSV 파일 경로로 변경
+    csv_file_path1 = process_dir / 'Process2/face_size_half_failed.csv'
+    result_writer = ResultWriter(csv_file_path, csv_file_path1, ["File_name", "Success", "Current pixel"], save_parquet)
+    image_writer = ImageWriter(workers=write_workers, route=route)
+    success_path = process_dir / 'Process2/face_size_success'
+    failed_path = process_dir / 'Process2/face_size_failed'
+    error_path = process_dir / 'Process2/face_detection_failed'
+    for d in (success_path, failed_path, error_path):
+        d.mkdir(parents=True, exist_ok=True)
+
+    # Per-stage span timing (이미지별 JSON lines, Chrome trace)
+    span = Spans(
+        save_dir / "spans.jsonl" if spans else None,
+        save_dir / "trace.json" if trace else None,
+        records=timings,
+        sync=torch.cuda.synchronize if device.type == "cuda" else None,
+    )
+    image_writer.spans = span
     
+    t_load = time.perf_counter()
     for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
+        span.add("decode", t_load, time.perf_counter() - t_load)  # dataloader decode/letterbox 대기 시간
+        with dt[0], span("pre-process"):
             im = torch.from_numpy(im).to(model.device)
             im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
             im /= 255  # 0 - 255 to 0.0 - 1.0
@@ -195,7 +297,7 @@ def run(
                 ims = torch.chunk(im, im.shape[0], 0)
 
         # Inference
-        with dt[1]:
+        with dt[1], span("inference"):
             visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
             if model.xml and im.shape[0] > 1:
                 pred = None
@@ -208,8 +310,9 @@ def run(
             else:
                 pred = model(im, augment=augment, visualize=visualize)
         # NMS
-        with dt[2]:
+        with dt[2], span("NMS"):
             pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+        span.split(len(pred))  # batch 단계 시간은 이미지 수로 나눔
 
         # Second-stage classifier (optional)
         # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
@@ -227,19 +330,16 @@ def run(
                     writer.writeheader()
                 writer.writerow(data)
 
-        success_path = Path('/content/yolov5/Police_assignment/Process/Process2/face_size_success')
-        failed_path = Path('/content/yolov5/Police_assignment/Process/Process2/face_size_failed')
-        error_path = Path('/content/yolov5/Police_assignment/Process/Process2/face_detection_failed')
-        Face_count = 0
-        
         # Process predictions
         for i, det in enumerate(pred):  # per image
             seen += 1
+            # 디코딩된 원본 버퍼를 복사 없이 사용, box label은 복사본에만 그림
             if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
+                p, im0, frame = path[i], im0s[i], dataset.count
                 s += f"{i}: "
             else:
-                p, im0, frame = path, im0s.copy(), getattr(dataset, "frame", 0)
+                p, im0, frame = path, im0s, getattr(dataset, "frame", 0)
+            original_im0 = imc = im0  # 이후 수정하지 않음
             
             
             p = Path(p)  # to Path
@@ -248,10 +348,8 @@ def run(
             txt_path = str(save_dir / "labels" / p.stem) + ("" if dataset.mode == "image" else f"_{frame}")  # im.txt
             s += "%gx%g " % im.shape[2:]  # print strizng
             gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
-            imc = im0.copy() if save_crop else im0  # for save_crop
-            annotator = Annotator(im0, line_width=line_thickness, example=str(names))
-
-            original_im0 = im0.copy()
+            plot = save_img or save_crop or view_img
+            annotator = Annotator(im0.copy() if plot else im0, line_width=line_thickness, example=str(names))
 
             
             
@@ -263,8 +361,6 @@ def run(
                 for c in det[:, 5].unique():
                     n = (det[:, 5] == c).sum()  # detections per class
                     s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
-                    if names[int(c)] == "Face":
-                        Face_count += n
 
                 # Write results
                 for *xyxy, conf, cls in reversed(det):
@@ -288,15 +384,17 @@ def run(
                         with open(f"{txt_path}.txt", "a") as f:
                             f.write(("%g " * len(line)).rstrip() % line + "\n")
 
-                    if save_img or save_crop or view_img:  # Add bbox to image
+                    if plot:  # Add bbox to image
                         c = int(cls)  # integer class
                         label = None if hide_labels else (names[c] if hide_conf else f"{names[c]} {conf:.2f}")
-                        annotator.box_label(xyxy, label, color=colors(c, True))
+                        with span("annotate"):
+                            annotator.box_label(xyxy, label, color=colors(c, True))
                     if save_crop:
                         save_one_box(xyxy, imc, file=save_dir / "crops" / names[c] / f"{p.stem}.jpg", BGR=True)
 
             # Stream results
-            im0 = annotator.result()
+            with span("annotate"):
+                im0 = annotator.result()
             if view_img:
                 if platform.system() == "Linux" and p not in windows:
                     windows.append(p)
@@ -308,7 +406,7 @@ def run(
         # Save results (image with detections)
             if save_img:
                 if dataset.mode == "image":
-                    cv2.imwrite(save_path, im0)
+                    image_writer.write(save_path, im0)
                 else:  # 'video' or 'stream'
                     if vid_path[i] != save_path:  # new video
                         vid_path[i] = save_path
@@ -323,46 +421,20 @@ def run(
                         save_path = str(Path(save_path).with_suffix(".mp4"))  # force *.mp4 suffix on results videos
                         vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
                     vid_writer[i].write(im0)
-            if Face_count ==1:
-                if box_area >= 250000:
-                    print("\n Size condition Success!\n")
-                    save_custom = success_path / f"{p.stem}.png"
-                    print(save_custom)
-                    cv2.imwrite(str(save_custom), original_im0)
-
-                    success = "O"
-                    current_pixel = str(box_area)
-                
-                    print()
-                    print()
-            
-                else:
-                    print("\nSize condition Failed!\n")
-                    save_custom = failed_path / f"{p.stem}.png"
-                    cv2.imwrite(str(save_custom), original_im0)
-                    print(f"Saved to: {save_custom}\n")
-
-                    success = "X"
-                    current_pixel = str(box_area)
-                
-                    print()
-                    print()
-            elif Face_count >=2:
-                print("\n Two or more faces detected")
-                save_custom = error_path / f"{p.stem}.png"
-                cv2.imwrite(str(save_custom), original_im0)
-                print(f"Saved to: {save_custom}\n")
-                success = "X"
-                current_pixel = str(box_area)
-                
+            with span("rules"):
+                success, Note, current_pixel = face_condition(det, names)
+            if success == "O":
+                print("\n Size condition Success!\n")
+                save_custom = success_path / f"{p.stem}.png"
+            elif Note == "face size failed":
+                print("\nSize condition Failed!\n")
+                save_custom = failed_path / f"{p.stem}.png"
             else:
-                print("\n No face detected")
+                print("\n No face detected" if current_pixel == "-" else "\n Two or more faces detected")
                 save_custom = error_path / f"{p.stem}.png"
-                cv2.imwrite(str(save_custom), original_im0)
-                print(f"Saved to: {save_custom}\n")
-                success = "X"
-                current_pixel = "-"
-            
+            image_writer.write_original(save_custom, original_im0, p)
+            print(f"Saved to: {save_custom}\n")
+
             # elif box_area * 4 >= 2500000:
             #     new_size = (input_image.shape[1] * 2, input_image.shape[0] * 2)
                 
@@ -370,21 +442,21 @@ def run(
             #     cv2.imwrite("output.png", resized_image)
             print(f"Final save path: {save_custom}\n\n")
 
-            current_result = pd.DataFrame([[file_name, success, current_pixel]], columns=["File_name","Success","Current pixel"])
-            # print("current_result", current_result) -> log
+            # print("record", [file_name, success, current_pixel]) -> log
             print()
-            df = pd.concat([df, current_result], ignore_index=True)
+            with span("bookkeeping"):
+                result_writer.write([file_name, success, current_pixel])
+            span.image_done(p, rest="other")  # span 밖의 시간 (로그, Annotator 준비 등)
             print()
-            failed_file_list = df[df["Success"] =="X"]
 
         
         # Print time (inference-only)
         LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-    
-    csv_file_path = '/content/yolov5/Police_assignment/Process/Process2/face_size_half_whole.csv'  # 원하는 CSV 파일 경로로 변경
-    csv_file_path1 = '/content/yolov5/Police_assignment/Process/Process2/face_size_half_failed.csv'
-    df.to_csv(csv_file_path, index=False, encoding='utf-8-sig')
-    failed_file_list.to_csv(csv_file_path1, index=False, encoding='utf-8-sig')
+        t_load = time.perf_counter()
+
+    span.close()
+    result_writer.close()
+    image_writer.close()  # 남은 이미지 저장이 끝날 때까지 대기
     
     # Print results
     t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
@@ -430,6 +502,22 @@ def parse_opt():
         --dnn (bool, optional): Flag to use OpenCV DNN for ONNX inference. Defaults to False.
         --vid-stride (int, optional): Video frame-rate stride, determining the number of frames to skip in between
             consecutive frames. Defaults to 1.
+        --save-parquet (bool, optional): Flag to also write the result CSVs as Parquet. Defaults to False.
+        --prefetch (int, optional): Number of background image decode workers, 0 to decode in the main thread.
+            Defaults to 0.
+        --prefetch-processes (bool, optional): Flag to decode images in a process pool instead of threads. Defaults to
+            False.
+        --write-workers (int, optional): Number of background threads that encode and write routed images, 0 to
+            write inline. Defaults to 0.
+        --route (str, optional): How unmodified originals are saved: 'png' (re-encode), 'link' (hardlink, reflink or
+            copy of the source file) or 'move' (rename). Defaults to 'png'.
+        --process-dir (str, optional): Root directory of the Process2 output directories and CSVs. Defaults to
+            '/content/yolov5/Police_assignment/Process'.
+        --spans (bool, optional): Flag to write per-image stage timings to spans.jsonl in the run directory. Defaults
+            to False.
+        --trace (bool, optional): Flag to write a Chrome trace timeline of all stages to trace.json. Defaults to False.
+        --rule-nms (bool, optional): Flag to run NMS on the Face class only with at most 2 detections, which keeps the
+            Process2 decision unchanged. Defaults to False.
 
     Returns:
         argparse.Namespace: Parsed command-line arguments as an argparse.Namespace object.
@@ -469,6 +557,15 @@ def parse_opt():
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
     parser.add_argument("--vid-stride", type=int, default=1, help="video frame-rate stride")
+    parser.add_argument("--save-parquet", action="store_true", help="also write the result CSVs as Parquet")
+    parser.add_argument("--prefetch", type=int, default=0, help="number of background image decode workers")
+    parser.add_argument("--prefetch-processes", action="store_true", help="decode images in processes, not threads")
+    parser.add_argument("--write-workers", type=int, default=0, help="number of background image write threads")
+    parser.add_argument("--route", default="png", choices=["png", "link", "move"], help="how to save unmodified originals")
+    parser.add_argument("--process-dir", default="/content/yolov5/Police_assignment/Process", help="Process2 output root")
+    parser.add_argument("--spans", action="store_true", help="write per-image stage timings to spans.jsonl")
+    parser.add_argument("--trace", action="store_true", help="write a Chrome trace of all stages to trace.json")
+    parser.add_argument("--rule-nms", action="store_true", help="NMS on the Face class only, at most 2 detections")
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -0,0 +1,151 @@
+"""
+Export the Process1 seg model and the Process2 face model to ONNX for CPU inference and verify them against PyTorch.
+
+Each exported model is run next to its .pt original on the same letterboxed images with ONNX Runtime (and with OpenCV
+DNN for --dnn). The report has the largest raw output difference, box agreement after NMS and whether the Process1
+class rule or the Process2 face rule would decide differently. It is printed and saved as <model>.verify.json.
+
+Usage:
+    $ python export_onnx.py --weights yolov5l-seg.pt face_detection_yolov5s.pt --source Raw_data --max-images 50
+    $ python export_onnx.py --weights yolov5l-seg.pt --dynamic  # dynamic batch/shape, ONNX Runtime only (--batch-size)
+
+Then run with the faster backend per model:
+    $ python predict8_ver4.py --weights yolov5l-seg.onnx --face-weights face_detection_yolov5s.onnx --face-dnn ...
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+import export
+from models.common import DetectMultiBackend
+from utils.dataloaders import LoadImages
+from utils.general import LOGGER, check_img_size, non_max_suppression, print_args, scale_boxes
+from utils.metrics import box_iou
+from utils.torch_utils import select_device
+
+from detect_Face3 import face_condition
+from predict8_ver4 import EXCLUDED_CLASSES
+
+
+def export_model(weights, imgsz=(640, 640), dynamic=False, simplify=True, opset=17):
+    """Exports one .pt model to ONNX next to it with yolov5 export.run and returns the .onnx path."""
+    f = export.run(weights=weights, imgsz=imgsz, include=("onnx",), device="cpu", dynamic=dynamic, simplify=simplify,
+                   opset=opset)
+    return Path([x for x in f if x and str(x).endswith(".onnx")][0])
+
+
+def rule_decision(det, names):
+    """Returns the Process1 class decision or the Process2 face decision of one image's detections."""
+    labels = [names[int(c)] for c in det[:, 5]]
+    if "Face" in names.values():
+        return face_condition(det, names)[:2]
+    n_person, n_excluded = labels.count("person"), sum(x in EXCLUDED_CLASSES for x in labels)
+    return "O" if n_person == 1 and n_excluded == 0 else "X"
+
+
+@torch.no_grad()
+def verify(pt_weights, onnx_weights, source, imgsz=(640, 640), dnn=False, conf_thres=0.25, iou_thres=0.45,
+           max_images=50):
+    """Compares an exported ONNX model with its PyTorch original on up to `max_images` images of `source`."""
+    device = select_device("cpu")
+    ref = DetectMultiBackend(pt_weights, device=device)
+    model = DetectMultiBackend(onnx_weights, device=device, dnn=dnn)
+    imgsz = check_img_size(imgsz, s=ref.stride)
+    names = ref.names
+    max_diff, ious, count_mismatch, flips, n = 0.0, [], 0, [], 0
+    for path, im, im0, _, _ in LoadImages(source, img_size=imgsz, stride=ref.stride, auto=False):  # 같은 입력 크기
+        im = torch.from_numpy(im).to(device).float()[None] / 255
+        y_ref, y = ref(im), model(im)
+        y_ref, y = (x[0] if isinstance(x, (list, tuple)) else x for x in (y_ref, y))
+        max_diff = max(max_diff, (y_ref - y).abs().max().item())
+        nm = y_ref.shape[-1] - 5 - len(names)  # seg model은 mask 계수 32개
+        det_ref, det = (non_max_suppression(x, conf_thres, iou_thres, nm=nm)[0] for x in (y_ref, y))
+        for d in (det_ref, det):
+            d[:, :4] = scale_boxes(im.shape[2:], d[:, :4], im0.shape)  # face 면적 조건은 원본 좌표 기준
+        if len(det_ref) != len(det) or (len(det) and (det_ref[:, 5] != det[:, 5]).any()):
+            count_mismatch += 1
+        elif len(det):
+            ious.extend(box_iou(det_ref[:, :4], det[:, :4]).diagonal().tolist())
+        if rule_decision(det_ref, names) != rule_decision(det, names):
+            flips.append(Path(path).name)
+        n += 1
+        if n >= max_images:
+            break
+    return {
+        "pt": str(pt_weights),
+        "onnx": str(onnx_weights),
+        "backend": "opencv-dnn" if dnn else "onnxruntime",
+        "images": n,
+        "max_abs_diff": max_diff,
+        "mean_box_iou": sum(ious) / len(ious) if ious else None,
+        "detection_mismatch_images": count_mismatch,
+        "decision_flips": flips,
+    }
+
+
+def run(
+    weights=ROOT / "yolov5l-seg.pt",  # .pt model path(s) to export
+    source=ROOT / "data/images",  # verification images
+    imgsz=(640, 640),  # export/inference size (height, width)
+    dynamic=False,  # dynamic batch and image size (ONNX Runtime only, not OpenCV DNN)
+    simplify=True,  # simplify the ONNX graph with onnx-simplifier
+    opset=17,  # ONNX opset version
+    dnn=False,  # also verify with OpenCV DNN
+    conf_thres=0.25,  # confidence threshold for the detection comparison
+    iou_thres=0.45,  # NMS IoU threshold
+    max_images=50,  # number of verification images
+):
+    """Exports every model in `weights` to ONNX and writes a verification report next to each export."""
+    reports = []
+    for w in weights if isinstance(weights, (list, tuple)) else [weights]:
+        f = export_model(w, imgsz, dynamic, simplify, opset)
+        for use_dnn in (False, True) if dnn and not dynamic else (False,):
+            r = verify(w, f, source, imgsz, use_dnn, conf_thres, iou_thres, max_images)
+            LOGGER.info(
+                f"{f.name} [{r['backend']}]: max |diff| {r['max_abs_diff']:.2e}, mean box IoU {r['mean_box_iou']}, "
+                f"{r['detection_mismatch_images']} detection mismatches, {len(r['decision_flips'])} decision flips "
+                f"on {r['images']} images"
+            )
+            reports.append(r)
+        f.with_suffix(".verify.json").write_text(json.dumps([r for r in reports if r["onnx"] == str(f)], indent=2))
+    return reports
+
+
+def parse_opt():
+    """Parses command-line options for ONNX export and verification."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", type=str, default=ROOT / "yolov5l-seg.pt", help="model.pt path(s)")
+    parser.add_argument("--source", type=str, default=ROOT / "data/images", help="verification images")
+    parser.add_argument("--imgsz", "--img", "--img-size", nargs="+", type=int, default=[640], help="image size h,w")
+    parser.add_argument("--dynamic", action="store_true", help="dynamic batch/shape axes (ONNX Runtime only)")
+    parser.add_argument("--no-simplify", dest="simplify", action="store_false", help="do not simplify the graph")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--dnn", action="store_true", help="also verify with OpenCV DNN")
+    parser.add_argument("--conf-thres", type=float, default=0.25, help="confidence threshold")
+    parser.add_argument("--iou-thres", type=float, default=0.45, help="NMS IoU threshold")
+    parser.add_argument("--max-images", type=int, default=50, help="number of verification images")
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Runs ONNX export and verification with the parsed options."""
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -27,11 +27,13 @@ Usage - formats:
                                           yolov5s-seg_edgetpu.tflite     # TensorFlow Edge TPU
                                           yolov5s-seg_paddle_model       # PaddlePaddle
 """
-import pandas as pd
 import argparse
+import csv
+import multiprocessing
 import os
 import platform
 import sys
+import time
 from pathlib import Path
 import torch
 import numpy as np
@@ -67,10 +69,27 @@ from utils.general import (
 from utils.segment.general import masks2segments, process_mask, process_mask_native
 from utils.torch_utils import select_device, smart_inference_mode
 
+from detect_Face3 import detect_faces, face_condition, face_rule_nms
+from process_utils import (
+    DetectionStore,
+    ImageWriter,
+    Manifest,
+    PrefetchImages,
+    ResultWriter,
+    Spans,
+    fingerprint,
+    list_images,
+    read_image_size,
+)
+from rules import EXCLUDED_CLASSES, MIN_PIXEL, PROCESS1, SCALE_FACTOR, image_columns, judge, min_upscale
+
+MAX_NMS = 30000  # non_max_suppression 내부의 NMS 후보 상한
+
+
 def upscale_image(image, scale_factor):
-    # 이미지 업스케일링
+    # 이미지 업스케일링 (소수 배율 허용)
     height, width = image.shape[:2]
-    new_size = (width * scale_factor, height * scale_factor)
+    new_size = (round(width * scale_factor), round(height * scale_factor))
     upscaled_image = cv2.resize(image, new_size, interpolation=cv2.INTER_LINEAR)
     return upscaled_image
 
@@ -94,6 +113,145 @@ def crop_further(im, xyxy, crop_left_right=0.05, crop_bottom=0.4):
     return cropped_img
 
 
+def proto_person_height(proto, det_row, im_shape, im0_shape):
+    """Returns the person height in original-image pixels measured from the row extent of its proto-resolution mask,
+    together with the height of one proto row in original pixels.
+    """
+    c, mh, mw = proto.shape  # CHW
+    ih, iw = im_shape
+    mask = (det_row[6:] @ proto.float().view(c, -1)).sigmoid().view(mh, mw)
+
+    # bbox(letterbox 좌표)를 proto 해상도로 줄여서 crop (process_mask의 crop_mask와 동일)
+    x1, y1, x2, y2 = (det_row[:4] * det_row.new_tensor([mw / iw, mh / ih, mw / iw, mh / ih])).tolist()
+    r = torch.arange(mw, device=mask.device)[None, :]  # cols
+    c = torch.arange(mh, device=mask.device)[:, None]  # rows
+    mask = mask * ((r >= x1) & (r < x2) & (c >= y1) & (c < y2))
+
+    # proto 한 줄 -> letterbox 픽셀 -> 원본 픽셀
+    gain = min(ih / im0_shape[0], iw / im0_shape[1])
+    row_height = ih / mh / gain
+    rows = torch.nonzero((mask > 0.5).any(1)).flatten()
+    if not len(rows):
+        return 0.0, row_height
+    return (rows[-1] - rows[0] + 1).item() * row_height, row_height
+
+
+def interp_weights(start, stop, in_size, out_size, device=None):
+    """Returns the (stop - start) x in_size matrix of F.interpolate(mode="bilinear", align_corners=False) weights that
+    produce output rows/cols start..stop-1 of an in_size -> out_size resize.
+    """
+    src = ((torch.arange(start, stop, device=device) + 0.5) * (in_size / out_size) - 0.5).clamp(min=0)
+    i0 = src.floor().long().clamp(max=in_size - 1)
+    i1 = (i0 + 1).clamp(max=in_size - 1)  # 마지막 행/열은 i0와 같음 (가중치 합 1)
+    lam = src - i0
+    r = torch.arange(len(src), device=device)
+    w = torch.zeros(len(src), in_size, device=device)
+    w.index_put_((r, i0), 1 - lam, accumulate=True)
+    w.index_put_((r, i1), lam, accumulate=True)
+    return w
+
+
+def process_mask_roi(protos, masks_in, bboxes, shape):
+    """
+    Computes native-resolution masks only inside their boxes, same pixels as process_mask_native without the N x H x W
+    tensor.
+
+    The masks are built and un-padded at proto resolution, then each one is bilinearly resized only for the rows and
+    columns of its box (separable interpolation weights, Wy @ mask @ Wx.T) and thresholded.
+
+    Args:
+        protos (torch.Tensor): Mask prototypes of one image, shape (nm, mh, mw).
+        masks_in (torch.Tensor): Mask coefficients, shape (n, nm).
+        bboxes (torch.Tensor): Boxes in original-image pixels (rounded), shape (n, 4).
+        shape (tuple[int, int]): Original image (height, width).
+
+    Returns:
+        (list[tuple[int, int, torch.Tensor]]): (x1, y1, bool bitmap of the box) per detection.
+    """
+    c, mh, mw = protos.shape  # CHW
+    h0, w0 = shape
+    gain = min(mh / h0, mw / w0)  # gain  = old / new
+    pad = (mw - w0 * gain) / 2, (mh - h0 * gain) / 2  # wh padding
+    top, left = int(pad[1]), int(pad[0])  # y, x
+    bottom, right = int(mh - pad[1]), int(mw - pad[0])
+    masks = (masks_in @ protos.float().view(c, -1)).sigmoid().view(-1, mh, mw)[:, top:bottom, left:right]
+    rois = []
+    for m, (x1, y1, x2, y2) in zip(masks, bboxes.int().tolist()):
+        x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(max(x2, x1), w0), min(max(y2, y1), h0)
+        wy = interp_weights(y1, y2, bottom - top, h0, m.device)
+        wx = interp_weights(x1, x2, right - left, w0, m.device)
+        rois.append((x1, y1, (wy @ m @ wx.T) > 0.5))
+    return rois
+
+
+def render_preview(im0, det, proto, names, line_width=3):
+    """Draws the masks and boxes of im0-scaled detections onto a copy of im0 for an annotated preview image."""
+    annotator = Annotator(im0.copy(), line_width=line_width, example=str(names))
+    if len(det):
+        masks = process_mask_native(proto, det[:, 6:], det[:, :4], im0.shape[:2])  # HWC
+        annotator.masks(
+            masks,
+            colors=[colors(x, True) for x in det[:, 5]],
+            im_gpu=torch.as_tensor(im0, dtype=torch.float16, device=proto.device).permute(2, 0, 1).flip(0) / 255,
+        )
+        for *xyxy, conf, cls in reversed(det[:, :6]):
+            c = int(cls)  # integer class
+            annotator.box_label(xyxy, f"{names[c]} {conf:.2f}", color=colors(c, True))
+    return annotator.result()
+
+
+def shard_path(path, k):
+    """Returns the per-shard variant of an output path, e.g. results.csv -> results.shard0.csv."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.shard{k}{path.suffix}")
+
+
+def load_models(weights, face_weights=None, device="", dnn=False, face_dnn=False, data=None, half=False):
+    """Loads the Process1 seg model and the optional Process2 face model, returning (model, face_model)."""
+    device = select_device(device)
+    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
+    face_model = DetectMultiBackend(face_weights, device=device, dnn=face_dnn, fp16=half) if face_weights else None
+    return model, face_model
+
+
+def run_shard(kwargs, threads):
+    """Entry point of a --workers child process: limits torch/OpenCV threads and runs one shard."""
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    run(**kwargs)
+
+
+def rule_nms_filter(names, classes=None, max_det=1000):
+    """Returns the NMS class filter and detection cap that decide the Process1 class rule exactly.
+
+    Only person and EXCLUDED_CLASSES detections are counted, and the rule passes only with exactly one of them, so a
+    second surviving detection already fails it. NMS offsets boxes by class, so dropping the other classes before NMS
+    cannot change which person/animal boxes survive, and keeping the top 2 decides the rule.
+    """
+    names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else names
+    rule = [k for k, v in names.items() if v == "person" or v in EXCLUDED_CLASSES]
+    rule = [k for k in rule if classes is None or k in classes]
+    return rule, min(max_det, 2)
+
+
+def stack(ims):
+    """Stacks letterboxed CHW images into a batch, as a view (no copy) for a single image."""
+    return ims[0][None] if len(ims) == 1 else np.stack(ims)
+
+
+def collate(dataset, batch_size):
+    """Groups (path, im, im0s, vid_cap, s) items from a dataloader into batches of up to `batch_size` images."""
+    batch = []
+    for item in dataset:
+        batch.append(item)
+        if len(batch) == batch_size:
+            paths, ims, im0s, vid_caps, ss = zip(*batch)
+            yield list(paths), stack(ims), list(im0s), vid_caps[0], list(ss)
+            batch = []
+    if batch:
+        paths, ims, im0s, vid_caps, ss = zip(*batch)
+        yield list(paths), stack(ims), list(im0s), vid_caps[0], list(ss)
+
 
 @smart_inference_mode()
 def run(
@@ -119,32 +277,253 @@ def run(
     name="exp",  # save results to project/name
     exist_ok=False,  # existing project/name ok, do not increment
     line_thickness=3,  # bounding box thickness (pixels)
-    hide_labels=False,  # hide labels
-    hide_conf=False,  # hide confidences
     half=False,  # use FP16 half-precision inference
     dnn=False,  # use OpenCV DNN for ONNX inference
     vid_stride=1,  # video frame-rate stride
     retina_masks=False,
+    roi_masks=False,  # with --retina-masks, compute the person's native-resolution mask only inside its box
+    batch_size=1,  # number of images per forward pass
+    face_weights=None,  # face model path(s), runs Process2 on Half crops in memory
+    face_conf_thres=0.25,  # face confidence threshold
+    face_dnn=False,  # use OpenCV DNN for an ONNX face model (--dnn applies to the seg model only)
+    save_parquet=False,  # also write the result CSVs as Parquet
+    size_gate=False,  # fail images below MIN_PIXEL even after x2 upscale from their headers, before inference
+    proto_height=False,  # measure person height on the proto-resolution mask, full masks only near the H/2 boundary
+    headless=False,  # never build annotated images except for --view-img or the previews below
+    preview_failed=False,  # in headless mode, save annotated previews of failed images
+    preview_every=0,  # in headless mode, save an annotated preview of every n-th image (0 = off)
+    prefetch=0,  # decode/letterbox images on this many background workers (0 = LoadImages in the main thread)
+    prefetch_processes=False,  # use a process pool instead of a thread pool for --prefetch
+    write_workers=0,  # encode/write routed images on this many background threads (0 = inline)
+    route="png",  # save unmodified originals as 'png' (re-encode), 'link' (hardlink/reflink/copy) or 'move' (rename)
+    resume=False,  # skip images already decided in the manifest and rebuild the CSVs from it
+    workers=1,  # shard the images across this many processes, each with its own model
+    shard=None,  # shard index of a --workers child process (internal)
+    process_dir="/home/selectstar/yolov5/Police_assignment/Process",  # Process1/Process2 output root (dirs and CSVs)
+    spans=False,  # write per-image stage timings to save_dir/spans.jsonl
+    trace=False,  # write a Chrome trace timeline of all stages to save_dir/trace.json
+    timings=None,  # list to append the per-image stage timing records to, e.g. for benchmark.py
+    rule_nms=False,  # NMS only on person + excluded animals with 2 detections (same O/X), annotations show only these
+    save_detections=False,  # save raw per-image detections to a columnar .npz next to the CSVs for rejudge.py
+    models=None,  # resident (model, face_model) from load_models(), e.g. watch.py, skips loading and warmup
+    append=False,  # append to the existing CSVs, manifest and detection store, e.g. watch.py micro-batches
 ):
     """Run YOLOv5 segmentation inference on diverse sources including images, videos, directories, and streams."""
-    source = str(source)
-    save_img = not nosave and not source.endswith(".txt")  # save inference images
-    is_file = Path(source).suffix[1:] in (IMG_FORMATS + VID_FORMATS)
-    is_url = source.lower().startswith(("rtsp://", "rtmp://", "http://", "https://"))
-    webcam = source.isnumeric() or source.endswith(".streams") or (is_url and not is_file)
-    screenshot = source.lower().startswith("screen")
-    if is_url and is_file:
-        source = check_file(source)  # download
+    settings = dict(locals())  # --workers 하위 프로세스에 같은 인자로 전달
+    if isinstance(source, (list, tuple)):  # image list, e.g. a --workers shard
+        source, save_img, webcam, screenshot = [str(x) for x in source], not nosave, False, False
+    else:
+        source = str(source)
+        save_img = not nosave and not source.endswith(".txt")  # save inference images
+        is_file = Path(source).suffix[1:] in (IMG_FORMATS + VID_FORMATS)
+        is_url = source.lower().startswith(("rtsp://", "rtmp://", "http://", "https://"))
+        webcam = source.isnumeric() or source.endswith(".streams") or (is_url and not is_file)
+        screenshot = source.lower().startswith("screen")
+        if is_url and is_file:
+            source = check_file(source)  # download
 
     # Directories
     save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
     (save_dir / "labels" if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
 
-    # Load model
-    device = select_device(device)
-    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
+    # Process directories
+    process_dir = Path(process_dir)
+    half_class_success_path = process_dir / 'Process1/half_class_success'
+    full_success_path = process_dir / 'Process1/full_success'
+    failed_path = process_dir / 'Process1/class_height_failed'
+    face_paths = {
+        "-": process_dir / 'Process2/face_size_success',
+        "face size failed": process_dir / 'Process2/face_size_failed',
+        "face detection failed": process_dir / 'Process2/face_detection_failed',
+    }
+
+    # Create directories if they don't exist
+    half_class_success_path.mkdir(parents=True, exist_ok=True)
+    full_success_path.mkdir(parents=True, exist_ok=True)
+    failed_path.mkdir(parents=True, exist_ok=True)
+    if face_weights:
+        for face_path in face_paths.values():
+            face_path.mkdir(parents=True, exist_ok=True)
+
+    columns = ["File_name", "Success", "Note", "Current pixel"] + (["Face pixel"] if face_weights else [])
+    csv_file_path = process_dir / 'Process1/class_height_whole_files.csv'  # 원하는 CSV 파일 경로로 변경
+    csv_file_path1 = process_dir / 'Process1/class_height_failed_files.csv'
+    if face_weights:  # Process1 + Process2 결과를 하나의 CSV로
+        csv_file_path = process_dir / 'process1_2_whole_files.csv'
+        csv_file_path1 = process_dir / 'process1_2_failed_files.csv'
+    manifest_path = csv_file_path.with_name(csv_file_path.stem.replace("_whole_files", "_manifest.jsonl"))
+    store_path = csv_file_path.with_name(csv_file_path.stem.replace("_whole_files", "_detections.npz"))
+    if shard is not None:  # --workers 하위 프로세스: shard별 파일에 쓰고 부모가 shard 순서대로 병합
+        csv_file_path, csv_file_path1 = shard_path(csv_file_path, shard), shard_path(csv_file_path1, shard)
+        manifest_path, store_path = shard_path(manifest_path, shard), shard_path(store_path, shard)
+    result_writer = ResultWriter(csv_file_path, csv_file_path1, columns, save_parquet=save_parquet, append=append)
+    image_writer = ImageWriter(workers=write_workers, route=route)
+
+    span = None  # model load 후에 생성
+
+    # 이미지별 판정 manifest (경로 + 파일 해시 + weights/threshold fingerprint), --resume 시 이미 판정된 이미지는 건너뜀
+    manifest = None
+    if not (webcam or screenshot):
+        run_fingerprint = fingerprint(
+            [weights] + ([face_weights] if face_weights else []),
+            imgsz=imgsz,
+            conf_thres=conf_thres,
+            iou_thres=iou_thres,
+            max_det=max_det,
+            classes=classes,
+            agnostic_nms=agnostic_nms,
+            augment=augment,
+            half=half,
+            retina_masks=retina_masks,
+            roi_masks=roi_masks,  # box 안에서만 만든 mask는 person 세로 길이가 다를 수 있음
+            proto_height=proto_height,
+            save_txt=save_txt,  # --save-txt/--proto-height 없이는 segment를 만들지 않아 "no segments"
+            size_gate=size_gate,  # header만 보고 Size failed (추론했다면 class failed일 수 있음)
+            face_conf_thres=face_conf_thres,
+            min_pixel=MIN_PIXEL,
+            scale_factor=SCALE_FACTOR,
+            upscale="min",  # 최소 배율 업스케일 (Current pixel, 저장 crop 크기가 달라짐)
+            columns=columns,
+        )
+        manifest = Manifest(manifest_path, run_fingerprint, resume=resume, append=append)
+        for leftover in sorted(manifest_path.parent.glob(shard_path(manifest_path, "*").name)):
+            if shard is not None:
+                break
+            if resume:  # 중단된 --workers 실행의 shard manifest
+                manifest.merge(leftover)
+            else:
+                leftover.unlink()
+        if resume:
+            files = list_images(source)
+            source = [f for f in files if not manifest.done(f)]
+            LOGGER.info(f"Resuming: {len(files) - len(source)}/{len(files)} images already decided in {manifest_path}")
+
+    # rejudge.py용 detection store (box, conf, cls, person mask 세로 길이, 이미지 크기, Full/Half), 실행 종료 시 저장
+    store = None
+    if save_detections and not (webcam or screenshot):
+        store_meta = dict(weights=weights, face_weights=face_weights)
+        store = DetectionStore(store_path, meta=store_meta, append=resume or append)
+        store.meta.update(conf_thres=conf_thres, iou_thres=iou_thres, face_conf_thres=face_conf_thres, imgsz=imgsz)
+        for leftover in sorted(store_path.parent.glob(shard_path(store_path, "*").name)):
+            if shard is not None:
+                break
+            if resume:
+                store.merge(leftover)
+            else:
+                leftover.unlink()
+
+    # 820만 픽셀 사전 검사: header의 width/height만 읽고, x2 업스케일로도 부족한 이미지는 추론 없이 Size failed 처리
+    if size_gate and not (webcam or screenshot):
+        gate_files, source = list_images(source), []
+        for f in gate_files:
+            width, height = read_image_size(f)
+            if width * height * SCALE_FACTOR**2 >= MIN_PIXEL:
+                source.append(f)
+                continue
+            stem = Path(f).stem
+            LOGGER.info(f"{f}: {width}x{height} size condition failed before inference")
+            if manifest is not None:
+                manifest.key(f)  # --route move 전에 hash
+            image_writer.write_original(failed_path / f"{stem}_scaled_failed.png", None, f)
+            record = [stem, "X", "Size failed", str(width * height)] + (["-"] if face_weights else [])
+            result_writer.write(record)
+            if manifest is not None:
+                manifest.write(f, record)
+            if store is not None:
+                store.add(f, width, height, inferred=False)
+
+    def finish():
+        """Closes the result/image writers and, when resuming, rebuilds the CSVs from the manifest."""
+        if span is not None:
+            span.close()
+        result_writer.close()
+        image_writer.close()  # 남은 이미지 저장이 끝날 때까지 대기
+        if store is not None:
+            store.close()
+        if manifest is not None:
+            manifest.close()
+            if resume:  # 이전 실행에서 판정된 이미지까지 포함해 CSV를 manifest에서 다시 작성
+                with ResultWriter(csv_file_path, csv_file_path1, columns, save_parquet=save_parquet) as writer:
+                    for record in manifest.records():
+                        writer.write(record)
+
+    # Multi-process: 남은 이미지를 연속된 shard로 나눠 프로세스마다 모델을 load, 결과는 shard 순서대로 병합
+    if workers > 1 and not (webcam or screenshot):
+        todo = list_images(source) if source else []
+        shards = [todo[k * len(todo) // workers : (k + 1) * len(todo) // workers] for k in range(workers)]
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        ctx = multiprocessing.get_context("spawn")
+        procs = []
+        for k, files_k in enumerate(shards):
+            if not files_k:
+                continue
+            kwargs = dict(
+                settings,
+                source=files_k,
+                project=save_dir.parent,
+                name=save_dir.name,
+                exist_ok=True,
+                view_img=False,
+                update=False,
+                save_parquet=False,
+                size_gate=False,
+                resume=False,
+                workers=1,
+                shard=k,
+                models=None,
+                append=False,
+            )
+            procs.append(ctx.Process(target=run_shard, args=(kwargs, threads), name=f"shard{k}"))
+        LOGGER.info(f"Running {len(todo)} images on {workers} workers x {threads} threads")
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        for k in range(workers):  # 실패한 shard도 manifest는 병합해서 --resume 가능하게
+            shard_csv = shard_path(csv_file_path, k)
+            if shard_csv.exists():
+                with open(shard_csv, newline="", encoding="utf-8-sig") as f:
+                    reader = csv.reader(f)
+                    next(reader, None)  # header
+                    for record in reader:
+                        result_writer.write(record)
+                shard_csv.unlink()
+            shard_path(csv_file_path1, k).unlink(missing_ok=True)
+            if manifest is not None and shard_path(manifest_path, k).exists():
+                manifest.merge(shard_path(manifest_path, k))
+            if store is not None and shard_path(store_path, k).exists():
+                store.merge(shard_path(store_path, k))
+        finish()
+        failed = [proc.name for proc in procs if proc.exitcode]
+        if failed:
+            raise RuntimeError(f"{', '.join(failed)} failed, rerun with --resume to finish the remaining images")
+        LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}")
+        return
+
+    # Load model (watch.py는 load_models()로 한 번 load한 model을 넘김)
+    resident = models is not None
+    model, face_model = models if resident else load_models(weights, face_weights, device, dnn, face_dnn, data, half)
+    device = model.device
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz, s=stride)  # check image size
+    face_classes, face_max_det = None, 1000
+    if rule_nms and not agnostic_nms:  # agnostic NMS는 다른 class box끼리도 억제하므로 제외
+        classes, max_det = rule_nms_filter(names, classes, max_det)
+        LOGGER.info(f"Rule-aware NMS: classes={classes}, max_det={max_det}")
+        # 후보가 MAX_NMS를 넘으면 NMS 전에 잘리는 후보가 달라질 수 있음 (stride 8/16/32, anchor 3개)
+        if 3 * imgsz[0] * imgsz[1] * (1 / 64 + 1 / 256 + 1 / 1024) > MAX_NMS:
+            LOGGER.warning(f"WARNING ⚠️ --rule-nms is only exact up to {MAX_NMS} candidates, use a smaller --imgsz")
+
+    # Process2 face model (fused Process1 -> Process2, Half crop는 디스크를 거치지 않고 바로 face detection)
+    if face_model is not None:
+        face_imgsz = check_img_size(imgsz, s=face_model.stride)
+        if not resident:
+            face_model.warmup(imgsz=(1, 3, *face_imgsz))
+        if rule_nms and not agnostic_nms:
+            face_classes, face_max_det = face_rule_nms(face_model.names)
+    if store is not None:  # rejudge.py는 실행이 남긴 class/max_det 밖의 판정을 re-run needed로 처리
+        store.meta.update(names=names, face_names=face_model.names if face_model else None)
+        store.meta.update(classes=classes, max_det=max_det)
 
     # Dataloader
     bs = 1  # batch_size
@@ -155,16 +534,39 @@ def run(
     elif screenshot:
         dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
     else:
-        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
+        bs = batch_size
+        # 배치 추론 시 모든 이미지를 같은 크기(imgsz)로 letterbox 해야 stack 가능
+        dataset = []  # size gate에서 모두 걸러진 경우
+        if source and prefetch:
+            auto = pt and bs == 1
+            dataset = PrefetchImages(
+                source, img_size=imgsz, stride=stride, auto=auto, workers=prefetch, processes=prefetch_processes
+            )
+        elif source:
+            dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt and bs == 1, vid_stride=vid_stride)
     vid_path, vid_writer = [None] * bs, [None] * bs
 
+    # Per-stage span timing (이미지별 JSON lines, Chrome trace)
+    spans_path, trace_path = save_dir / "spans.jsonl", save_dir / "trace.json"
+    if shard is not None:
+        spans_path, trace_path = shard_path(spans_path, shard), shard_path(trace_path, shard)
+    span = Spans(
+        spans_path if spans else None,
+        trace_path if trace else None,
+        records=timings,
+        sync=torch.cuda.synchronize if device.type == "cuda" else None,
+    )
+    image_writer.spans = span
+
     # Run inference
-    model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warmup
+    if not resident:
+        model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warmup
     seen, windows, dt = 0, [], (Profile(device=device), Profile(device=device), Profile(device=device))
-    df = pd.DataFrame(columns=["File_name","Success", "Note","Current pixel"])
 
-    for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
+    t_load = time.perf_counter()
+    for path, im, im0s, vid_cap, ss in dataset if webcam else collate(dataset, bs):
+        span.add("decode", t_load, time.perf_counter() - t_load)  # dataloader decode/letterbox 대기 시간
+        with dt[0], span("pre-process"):
             im = torch.from_numpy(im).to(model.device)
             im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
             im /= 255  # 0 - 255 to 0.0 - 1.0
@@ -172,51 +574,47 @@ def run(
                 im = im[None]  # expand for batch dim
 
         # Inference
-        with dt[1]:
-            visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
+        with dt[1], span("inference"):
+            visualize = increment_path(save_dir / Path(path[0]).stem, mkdir=True) if visualize else False
             pred, proto = model(im, augment=augment, visualize=visualize)[:2]
 
         # NMS
-        with dt[2]:
+        with dt[2], span("NMS"):
             pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det, nm=32)
+        span.split(len(pred))  # batch 단계 시간은 이미지 수로 나눔
 
         # Second-stage classifier (optional)
         # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
 
-
-        # Initialize person variable
-        person_counter = 0
-        half_class_success_path = Path('/home/selectstar/yolov5/Police_assignment/Process/Process1/half_class_success')
-        full_success_path = Path('/home/selectstar/yolov5/Police_assignment/Process/Process1/full_success')
-        failed_path = Path('/home/selectstar/yolov5/Police_assignment/Process/Process1/class_height_failed')
-
         save_custom = ""
         Scaled =""
         Note=""
         Success=""
-        scale_factor =2 
         results = {}
-        
-        # Create directories if they don't exist
-        # success_path.mkdir(parents=True, exist_ok=True)
-        
-        half_class_success_path.mkdir(parents=True, exist_ok=True)
-        full_success_path.mkdir(parents=True, exist_ok=True)
-        failed_path.mkdir(parents=True, exist_ok=True)
-
-        
+
         # Process predictions
         for i, det in enumerate(pred):  # per image
+            # Initialize person variable
+            person_counter = 0
+            excluded_count = 0
             y_min_pixel = 0
             y_max_pixel = 0
             Current_pixel = 0
+            Face_pixel = "-"
+            face_det = None  # detection store용 (crop 좌표, 업스케일 전)
+            has_segment = False
             seen += 1
+            # 디코딩된 원본 버퍼 하나를 복사 없이 사용 (crop, routing, preview는 view/읽기만), annotation만 복사본에 그림
             if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
-                s += f"{i}: "
+                p, im0, frame = path[i], im0s[i], dataset.count
+                s = f"{ss}{i}: "
             else:
-                p, im0, frame = path, im0s.copy(), getattr(dataset, "frame", 0)
+                p, im0, frame = path[i], im0s[i], getattr(dataset, "frame", 0)
+                s = ss[i]
+            original_im0 = imc = im0  # 이후 수정하지 않음
 
+            if manifest is not None:
+                manifest.key(path[i])  # --route move 전에 hash
             p = Path(p)  # to Path
             file_name = p.stem
             is_full = "Full" in file_name
@@ -229,84 +627,100 @@ def run(
             
             txt_path = str(save_dir / "labels" / p.stem) + ("" if dataset.mode == "image" else f"_{frame}")  # im.txt
             s += "%gx%g " % im.shape[2:]  # print string
-            imc = im0.copy() if save_crop else im0  # for save_crop
-            annotator = Annotator(im0, line_width=line_thickness, example=str(names))
-
-            original_im0 = im0.copy()
+            # headless 모드에서는 Annotator를 만들지 않음 (routing은 원본 이미지 사용)
+            annotator = None
+            if view_img or (save_img and not headless):
+                annotator = Annotator(im0.copy(), line_width=line_thickness, example=str(names))  # 그리는 경우만 복사
 
             if len(det):
-                if retina_masks:
-                    # Scale bbox first then crop masks
-                    det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()  # Rescale boxes to im0 size
-                    masks = process_mask_native(proto[i], det[:, 6:], det[:, :4], im0.shape[:2])  # HWC
-                else:
-                    masks = process_mask(proto[i], det[:, 6:], det[:, :4], im.shape[2:], upsample=True)  # HWC
-                    det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()  # Rescale boxes to im0 size
-
-        # Segments
-                if save_txt:
-                    segments = [
-                        scale_segments(im0.shape if retina_masks else im.shape[2:], x, im0.shape, normalize=True)
-                        for x in reversed(masks2segments(masks))
-                    ]
-
         # Print results
-                excluded_classes = ["bird", "cat", "dog", "horse", "cow", "elephant", "bear", "zebra", "giraffe",]
-                excluded_count = 0
                 for c in det[:, 5].unique():
                     n = (det[:, 5] == c).sum()  # Detections per class
                     s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # Add to string
                     if names[int(c)] == "person":
                         person_counter += n  # Increment person counter
-                    elif names[int(c)] in excluded_classes:
+                    elif names[int(c)] in EXCLUDED_CLASSES:
                         excluded_count += n
 
+                # class 조건은 det[:, 5]만으로 먼저 판단, mask는 조건을 통과한 person 한 명에 대해서만 계산
+                class_success = person_counter == 1 and excluded_count == 0
+                person_j = next((j for j, c in enumerate(det[:, 5]) if names[int(c)] == "person"), None)
+                plot = annotator is not None  # plotting에는 모든 detection의 mask가 필요
+
+                # proto 해상도에서 키를 먼저 계산, H/2 경계 근처일 때만 full resolution mask/segment로 다시 계산
+                full_height = True
+                if proto_height and class_success:
+                    with span("proto-height"):
+                        person_height, row_height = proto_person_height(proto[i], det[person_j], im.shape[2:], im0.shape)
+                    full_height = abs(person_height - image_height / 2) <= 2 * row_height
+                need_segments = class_success and full_height and (save_txt or proto_height)
+                extent = np.full(len(det), np.nan, np.float32)  # person mask 세로 길이 (detection store용)
+                if store is not None:  # 나머지 person은 proto 해상도로 (conf/class 조건을 바꿔 rejudge할 때 사용)
+                    with span("proto-height"):
+                        for j in [j for j, c in enumerate(det[:, 5]) if names[int(c)] == "person"]:
+                            extent[j] = proto_person_height(proto[i], det[j], im.shape[2:], im0.shape)[0]
+
+                masks, person_roi = None, None
+                rows = slice(None) if plot else [person_j]
+                with span("masks"):
+                    if retina_masks and roi_masks:
+                        # person mask는 bbox 안만 native 해상도로, plotting은 letterbox 해상도 mask 사용
+                        if plot:
+                            masks = process_mask(proto[i], det[:, 6:], det[:, :4], im.shape[2:], upsample=True)  # HWC
+                        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()  # Rescale boxes to im0 size
+                        if need_segments:
+                            j = [person_j]
+                            person_roi = process_mask_roi(proto[i], det[j, 6:], det[j, :4], im0.shape[:2])[0]
+                    elif retina_masks:
+                        # Scale bbox first then crop masks
+                        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()  # Rescale boxes to im0 size
+                        if plot or need_segments:
+                            masks = process_mask_native(proto[i], det[rows, 6:], det[rows, :4], im0.shape[:2])  # HWC
+                    else:
+                        if plot or need_segments:
+                            masks = process_mask(proto[i], det[rows, 6:], det[rows, :4], im.shape[2:], upsample=True)  # HWC
+                        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()  # Rescale boxes to im0 size
+
                 # Mask plotting
-                annotator.masks(
-                    masks,
-                    colors=[colors(x, True) for x in det[:, 5]],
-                    im_gpu=torch.as_tensor(im0, dtype=torch.float16).to(device).permute(2, 0, 1).flip(0).contiguous() / 255 if retina_masks else im[i],
-        )
-                image_height = im0.shape[0]
-        
-        # Write results
-                segment_data_list = []
-                for j, (*xyxy, conf, cls) in enumerate(reversed(det[:, :6])):
-                    if save_txt:  # Save to JSON
-                        if names[int(cls)] == "person":
-                            seg = segments[j].reshape(-1)  # (n,2) to (n*2)
-                            segment_list = [seg[i:i+2].tolist() for i in range(0, len(seg), 2)]  # Convert to list of [x, y] pairs
-                            segment_data = {
-                                'class': int(cls),
-                                'confidence': conf.item(),
-                                'polygon': segment_list
-                            }
-                            segment_data_list.append(segment_data)
-                if not segment_data_list:
-                    print(f"No segments found for {p.name}, detecting failed.")
-                    success = "X"
-                    Note = "no segments"
-                    Scaled = "X"
-                    Current_pixel = str(image_size)
-                    # Save the image as a failed result
-                    save_custom = failed_path / f"{p.stem}.png"
-                    if save_img:
-                        if dataset.mode == "image":
-                            cv2.imwrite(save_custom, im0)
-        # Continue to the next image
-                            continue
-                else:
-                    y_values = [point[1] for point in segment_list]
-                    y_min = min(y_values)
-                    y_max = max(y_values)
-                    # print("y min", y_min)  debugging log
-                    # print("y max", y_max)
+                if plot:
+                    with span("annotate"):
+                        annotator.masks(
+                            masks,
+                            colors=[colors(x, True) for x in det[:, 5]],
+                            im_gpu=torch.as_tensor(im0, dtype=torch.float16).to(device).permute(2, 0, 1).flip(0).contiguous() / 255 if retina_masks and not roi_masks else im[i],
+                        )
 
-                    y_min_pixel = y_min * image_height  # Convert to pixel
-                    y_max_pixel = y_max * image_height  # Convert to pixel
+        # Segments
+                with span("segments"):
+                    if class_success:
+                        *xyxy, conf, cls = det[person_j, :6]  # Half crop / box label에 사용할 person detection
+                        if not full_height:  # proto 해상도 키 사용
+                            has_segment = person_height > 0
+                            y_min_pixel, y_max_pixel = 0, person_height
+                        else:
+                            segment = np.zeros((0, 2))
+                            if person_roi is not None:  # bbox 안 bitmap의 contour를 원본 좌표로 이동
+                                x1, y1, bitmap = person_roi
+                                segment = masks2segments(bitmap[None])[0] + np.array([x1, y1], dtype=np.float32)
+                                segment = scale_segments(im0.shape, segment, im0.shape, normalize=True)
+                            elif need_segments:
+                                person_mask = masks[person_j] if plot else masks[0]
+                                segment = masks2segments(person_mask[None])[0]
+                                segment = scale_segments(im0.shape if retina_masks else im.shape[2:], segment, im0.shape, normalize=True)
+                            has_segment = len(segment) > 0
+                            if has_segment:
+                                y_min, y_max = segment[:, 1].min(), segment[:, 1].max()
+                                # print("y min", y_min)  debugging log
+                                # print("y max", y_max)
+
+                                y_min_pixel = y_min * image_height  # Convert to pixel
+                                y_max_pixel = y_max * image_height  # Convert to pixel
+                        extent[person_j] = y_max_pixel - y_min_pixel if has_segment else 0.0
 
             # Stream results
-            im0 = annotator.result()
+            if annotator is not None:
+                with span("annotate"):
+                    im0 = annotator.result()
             if view_img:
                 if platform.system() == "Linux" and p not in windows:
                     windows.append(p)
@@ -317,9 +731,9 @@ def run(
                     exit()
 
             # Save results (image with detections)
-            if save_img:
+            if save_img and annotator is not None:
                 if dataset.mode == "image":
-                    cv2.imwrite(save_path, im0)
+                    image_writer.write(save_path, im0)
 
             
                 # else:  # 'video' or 'stream'
@@ -338,169 +752,90 @@ def run(
                 #     vid_writer[i].write(im0)
             
             
-            # Process1 조건 ㅎㅎ
-            # class 확인
-            if person_counter == 1 and excluded_count == 0:
-                
-            #원본 사이즈 조건 확인
-                if image_size>= 8200000:
-                    
-                    # Full의 경우 높이 조건을 추가로 검사
-                    if is_full:
-
-                        if (y_max_pixel - y_min_pixel) >= image_height / 2:
-                            print(f"image condition: {int(image_height / 2)}, person height: {int(y_max_pixel - y_min_pixel)}")
-                            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                            
-                            print("Full file Condition Success!!! \n")
-                            save_custom = full_success_path / f"{p.stem}.png"
-                            success = "O"
-                            Note = "-"
-                            Scaled = "X"
-                            Current_pixel = str(image_size)
-                            cv2.imwrite(str(save_custom), original_im0)
-                        else:
-                            print(f"image condition: {int(image_height / 2)}, person height: {int(y_max_pixel - y_min_pixel)}")
-                            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                            
-                            print("height condition failed!!!!\n\n")
-                            save_custom = failed_path / f"{p.stem}.png"
-
-                            success = "X"
-                            Note = "height failed"
-                            Scaled = "X"
-                            Current_pixel = str(image_size)
-                            if save_img:
-                                if dataset.mode == "image":
-                                    cv2.imwrite(save_custom, im0)
-                            
-                    elif is_half:    # Half의 경우 높이 조건 없이 성공 처리
-                    
-                        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                        print("Half file condition Success!!! \n")
-                        save_custom = half_class_success_path / f"{p.stem}.png"
-                        success = "O"
-                        Note = "-"
-                        Scaled = "X"
-                        Current_pixel = str(image_size)
-                        if save_img or save_crop or view_img:  # Add bbox to image
-                            c = int(cls)  # integer class
-                            label = None if hide_labels else (names[c] if hide_conf else f"{names[c]} {conf:.2f}")
-                            annotator.box_label(xyxy, label, color=colors(c, True))
-                        # annotator.draw.polygon(segments[j], outline=colors(c, True), width=3)
-                        if save_crop and names[c] == 'person':
-                            # save_one_box(xyxy, imc, file=save_dir / "crops" / names[c] / f"{p.stem}.jpg", BGR=True)
-                            cropped_image = crop_further(imc, xyxy)
-                            save_custom = half_class_success_path / f"{p.stem}.png"
-                            cv2.imwrite(str(save_custom), cropped_image)
-                        
-                        
-                # 820만 픽셀 미만일 경우, 스케일링 필요여부 확인
+            # Process1 조건: rules.PROCESS1을 순서대로 검사, 처음 실패한 rule이 Note
+            kind = 1 if is_full else 2 if is_half else 0
+            person_extent = float(y_max_pixel - y_min_pixel) if has_segment else 0.0
+            with span("rules"):
+                cols = image_columns(
+                    image_width, image_height, kind, int(person_counter), int(excluded_count), person_extent
+                )
+                success, Note, Current_pixel = (x[0].item() for x in judge(PROCESS1, cols))
+            Current_pixel = str(Current_pixel)
+            scaled = image_size < MIN_PIXEL  # 통과하면 MIN_PIXEL을 넘기는 최소 배율로 업스케일
+            suffix = "_scaled" if scaled else ""
+            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
+            print(f"Process1: {success or '-'} ({Note}), person count: {int(person_counter)}, "
+                  f"person height: {int(person_extent)}/{image_height}, pixels: {image_size}\n")
+
+            if Note == "Size failed":  # 최대 배율로 업스케일해도 MIN_PIXEL 미만
+                image_writer.write_original(failed_path / f"{p.stem}_scaled_failed.png", original_im0, p)
+            elif Note in ("class failed", "no segments") or (Note == "height failed" and not scaled):
+                if save_img and dataset.mode == "image":
+                    save_custom = failed_path / f"{p.name if Note == 'class failed' else p.stem}.png"
+                    image_writer.write_original(save_custom, im0, p)
+            elif Note == "height failed":  # 키와 이미지 높이가 같은 배율로 커지므로 원본 기준으로 비교
+                save_custom = failed_path / f"{p.stem}_scaled.png"
+                failed_im = im0 if save_img and dataset.mode == "image" else original_im0
+                image_writer.write_original(save_custom, failed_im, p)
+            elif success == "O" and is_full:  # 저장은 원본 그대로
+                image_writer.write_original(full_success_path / f"{p.stem}{suffix}.png", original_im0, p)
+            elif success == "O" and is_half:
+                # 크기는 계산만 하고 resize는 저장되는 Half crop에만 적용
+                scale = float(min_upscale(image_width, image_height)[0])
+                if face_model is not None:
+                    with span("crop"):
+                        cropped_image = crop_further(original_im0, xyxy)
+                    with span("face"):
+                        det_face = detect_faces(
+                            face_model, cropped_image, face_imgsz, face_conf_thres, iou_thres, face_classes,
+                            max_det=face_max_det,
+                        )
+                        face_det = det_face[:, :6].clone()
+                        det_face[:, :4] = (det_face[:, :4] * scale).round()  # 저장되는 업스케일 crop 좌표 (Process2와 같은 면적)
+                        with span("rules"):
+                            success, Note, Face_pixel = face_condition(det_face, face_model.names)
+                    print(f"face condition: {Note}, face pixel: {Face_pixel}\n")
+                    save_custom = face_paths[Note] / f"{p.stem}{suffix}.png"
+                elif save_crop and names[int(cls)] == "person":
+                    with span("crop"):
+                        cropped_image = crop_further(imc, xyxy)
+                    save_custom = half_class_success_path / f"{p.stem}{suffix}.png"
                 else:
-                    if image_size * scale_factor**2 >= 8200000:
-                    
-                    
-                        if is_half:
-                            upscaled_im0 = upscale_image(im0, scale_factor)
-                            upscaled_width, upscaled_height = upscaled_im0.shape[1], upscaled_im0.shape[0]
-                            scaled_size = upscaled_width * upscaled_height
-                            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                            print("Condition Success after upscaling!!! \n")
-                            save_custom = half_class_success_path / f"{p.stem}_scaled.png"
-                            success = "O"
-                            Note = "-"
-                            Scaled = "O"
-                            Current_pixel = str(scaled_size)
-                            if save_img or save_crop or view_img:  # Add bbox to image
-                                c = int(cls)  # integer class
-                                label = None if hide_labels else (names[c] if hide_conf else f"{names[c]} {conf:.2f}")
-                                annotator.box_label(xyxy, label, color=colors(c, True))
-                        # annotator.draw.polygon(segments[j], outline=colors(c, True), width=3)
-                            if save_crop and names[c] == 'person':
-                                # save_one_box(xyxy, imc, file=save_dir / "crops" / names[c] / f"{p.stem}.jpg", BGR=True)
-                                cropped_image = crop_further(imc, xyxy)
-                                cv2.imwrite(str(save_custom), cropped_image)
-                        # Full 이미지에 대해 높이 조건 통과 후 업스케일링
-                        elif is_full:
-                            
-                            
-                            if (y_max_pixel - y_min_pixel) >= (upscaled_height / 2):
-                                print(f"image condition: {int(image_height / 2)}, person height: {int(y_max_pixel - y_min_pixel)}")
-                                upscaled_im0 = upscale_image(im0, scale_factor)
-                                upscaled_width, upscaled_height = upscaled_im0.shape[1], upscaled_im0.shape[0]
-                                scaled_size = upscaled_width * upscaled_height
-                                LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                                print("Condition Success after upscaling!!! \n")
-                                save_custom = full_success_path / f"{p.stem}_scaled.png"
-                                success = "O"
-                                Note = "-"
-                                Scaled = "O"
-                                Current_pixel = str(scaled_size)
-                                cv2.imwrite(str(save_custom), original_im0)
-                            
-                            else:
-                                print(f"image condition: {int(image_height / 2)}, person height: {int(y_max_pixel - y_min_pixel)}")
-                                LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                                print(f"height condition failed after upscaling!!!!\n\n")
-                                save_custom = failed_path / f"{p.stem}_scaled.png"
-                                success = "X"
-                                Note = "height failed"
-                                Scaled = "X"
-                                Current_pixel = str(image_size)
-                                cv2.imwrite(str(save_custom), original_im0)
-                                if save_img:
-                                    if dataset.mode == "image":
-                                        cv2.imwrite(save_custom, im0)
-
-                    
-                    
-                    else: # 2스케일링 해도 820만 픽셀 미만일 경우
-                        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                        print(f"size condition failed!!!!\n\n")
-                        save_custom = failed_path / f"{p.stem}_scaled_failed.png"
-                        success = "X"
-                        Note = "Size failed"
-                        Scaled = "X"
-                        Current_pixel = str(image_size)
-                        cv2.imwrite(str(save_custom), original_im0)
-            
-            else:  # 클래스 조건 실패 시
-        
-                print(f"failed person count: {person_counter}")
-                LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-                print("class condition failed!!!!\n\n")
-                save_custom = failed_path / f"{p.name}.png"
-                # print("Final save dir", save_custom) -> log 확인 용
-                success = "X"
-                Note = "class failed"
-                Scaled = "X"
-                Current_pixel = str(image_size)
-                if save_img:
-                    if dataset.mode == "image":
-                        cv2.imwrite(save_custom, im0)
-                # cv2.imwrite(str(save_custom), original_im0)
-            
-            # cv2.imwrite(str(save_custom), original_im0)
-            
+                    cropped_image = None
+                if cropped_image is not None:
+                    if scaled:
+                        with span("upscale"):
+                            cropped_image = upscale_image(cropped_image, scale)
+                    image_writer.write(save_custom, cropped_image)
+
+            # headless 모드: 실패 이미지 또는 n장마다 한 장만 annotated preview 저장
+            if headless and (
+                (preview_failed and success == "X") or (preview_every and seen % preview_every == 0)
+            ):
+                with span("annotate"):
+                    preview = render_preview(original_im0, det, proto[i], names, line_thickness)
+                image_writer.write(save_path, preview)
+
             results[file_name] = success
-            current_result = pd.DataFrame([[file_name, success, Note, Current_pixel ]], columns=["File_name","Success","Note","Current pixel"])
-            # print("current_result", current_result) -> log
+            record = [file_name, success, Note, Current_pixel] + ([Face_pixel] if face_model else [])
+            # print("record", record) -> log
             print()
-            df = pd.concat([df, current_result], ignore_index=True)
+            with span("bookkeeping"):
+                result_writer.write(record)
+                if manifest is not None:
+                    manifest.write(path[i], record)
+                if store is not None:
+                    store.add(path[i], image_width, image_height, det[:, :6], extent if len(det) else None, face_det)
+            span.image_done(p, rest="other")  # span 밖의 시간 (로그, Annotator 준비 등)
             print()
-            failed_file_list = df[df["Success"] =="X"]
-            
-            # print(df) -> log
+        t_load = time.perf_counter()
 
-    # Step 3: After processing all images, save the DataFrame to a CSV file
-    csv_file_path = '/home/selectstar/yolov5/Police_assignment/Process/Process1/class_height_whole_files.csv'  # 원하는 CSV 파일 경로로 변경
-    csv_file_path1 = '/home/selectstar/yolov5/Police_assignment/Process/Process1/class_height_failed_files.csv'
-    df.to_csv(csv_file_path, index=False, encoding='utf-8-sig')
-    failed_file_list.to_csv(csv_file_path1, index=False, encoding='utf-8-sig')
+    # Step 3: After processing all images, flush the remaining rows to the CSV files
+    finish()
     
     # Print results
-    t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
-    LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}" % t)
+    t = tuple(x.t / max(seen, 1) * 1e3 for x in dt)  # speeds per image (size gate에서 모두 걸러지면 0장)
+    LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(bs, 3, *imgsz)}" % t)
     if save_txt or save_img:
         s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ""
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
@@ -535,12 +870,34 @@ def parse_opt():
     parser.add_argument("--name", default="exp", help="save results to project/name")
     parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
     parser.add_argument("--line-thickness", default=3, type=int, help="bounding box thickness (pixels)")
-    parser.add_argument("--hide-labels", default=False, action="store_true", help="hide labels")
-    parser.add_argument("--hide-conf", default=False, action="store_true", help="hide confidences")
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
     parser.add_argument("--vid-stride", type=int, default=1, help="video frame-rate stride")
     parser.add_argument("--retina-masks", action="store_true", help="whether to plot masks in native resolution")
+    parser.add_argument("--roi-masks", action="store_true", help="retina masks only inside each box (less memory)")
+    parser.add_argument("--batch-size", type=int, default=1, help="number of images per forward pass")
+    parser.add_argument("--face-weights", nargs="+", type=str, default=None, help="face model path(s) for fused Process2")
+    parser.add_argument("--face-conf-thres", type=float, default=0.25, help="face confidence threshold")
+    parser.add_argument("--face-dnn", action="store_true", help="use OpenCV DNN for an ONNX face model")
+    parser.add_argument("--save-parquet", action="store_true", help="also write the result CSVs as Parquet")
+    parser.add_argument("--size-gate", action="store_true", help="fail undersized images from headers before inference")
+    parser.add_argument("--proto-height", action="store_true", help="measure person height on proto-resolution masks")
+    parser.add_argument("--headless", action="store_true", help="skip annotation, route original images only")
+    parser.add_argument("--preview-failed", action="store_true", help="headless: save annotated previews of failures")
+    parser.add_argument("--preview-every", type=int, default=0, help="headless: save a preview every n images")
+    parser.add_argument("--prefetch", type=int, default=0, help="number of background image decode workers")
+    parser.add_argument("--prefetch-processes", action="store_true", help="decode images in processes, not threads")
+    parser.add_argument("--write-workers", type=int, default=0, help="number of background image write threads")
+    parser.add_argument("--route", default="png", choices=["png", "link", "move"], help="how to save unmodified originals")
+    parser.add_argument("--resume", action="store_true", help="skip images already decided in the manifest")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to shard the images across")
+    parser.add_argument("--spans", action="store_true", help="write per-image stage timings to spans.jsonl")
+    parser.add_argument("--trace", action="store_true", help="write a Chrome trace of all stages to trace.json")
+    parser.add_argument("--rule-nms", action="store_true", help="NMS only on the rule classes, at most 2 detections")
+    parser.add_argument("--save-detections", action="store_true", help="save raw detections for rejudge.py")
+    parser.add_argument(
+        "--process-dir", default="/home/selectstar/yolov5/Police_assignment/Process", help="Process1/2 output root"
+    )
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -0,0 +1,673 @@
+"""Shared helpers for the Process1 (predict8_ver4.py) and Process2 (detect_Face3.py) pipelines."""
+import csv
+import errno
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.augmentations import letterbox
+from utils.dataloaders import IMG_FORMATS
+from utils.general import check_requirements
+
+
+class ResultWriter:
+    """Streams per-image result rows to the whole-files and failed-files CSVs (optionally Parquet) with bounded
+    buffering.
+    """
+
+    def __init__(self, csv_path, failed_csv_path, columns, save_parquet=False, flush_every=100, append=False):
+        """Opens both CSV outputs, writing the header unless appending to a non-empty file. Parquet files cannot be
+        appended to, so `save_parquet` is rejected in append mode.
+        """
+        if save_parquet and append:
+            raise ValueError("save_parquet cannot be used with append, each call would overwrite the Parquet files")
+        self.columns = list(columns)
+        self.flush_every = flush_every
+        self.rows = []
+        self.files, self.writers = [], []
+        for path in (csv_path, failed_csv_path):
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            f = open(path, "a" if append else "w", newline="", encoding="utf-8-sig")
+            writer = csv.writer(f, lineterminator="\n")
+            if f.tell() == 0:
+                writer.writerow(self.columns)
+            self.files.append(f)
+            self.writers.append(writer)
+        self.parquet_writers = []
+        if save_parquet:
+            check_requirements("pyarrow")
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self.schema = pa.schema([(c, pa.string()) for c in self.columns])
+            self.parquet_writers = [
+                pq.ParquetWriter(str(Path(path).with_suffix(".parquet")), self.schema)
+                for path in (csv_path, failed_csv_path)
+            ]
+
+    def write(self, record):
+        """Buffers one result row and flushes once `flush_every` rows are pending."""
+        self.rows.append([str(x) for x in record])
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered rows to the outputs; failed rows (Success == 'X') also go to the failed outputs."""
+        if not self.rows:
+            return
+        success = self.columns.index("Success")
+        failed = [row for row in self.rows if row[success] == "X"]
+        for writer, f, rows in zip(self.writers, self.files, (self.rows, failed)):
+            writer.writerows(rows)
+            f.flush()
+        for writer, rows in zip(self.parquet_writers, (self.rows, failed)):
+            if rows:
+                import pyarrow as pa
+
+                writer.write_table(pa.Table.from_pylist([dict(zip(self.columns, row)) for row in rows], self.schema))
+        self.rows = []
+
+    def close(self):
+        """Flushes any pending rows and closes all outputs."""
+        self.flush()
+        for f in self.files:
+            f.close()
+        for writer in self.parquet_writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def file_digest(path):
+    """Returns the BLAKE2b content hash of a file, read in 1MB chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def stat_digest(path, size, mtime_ns):
+    """Returns file_digest() of a file, cached per (path, size, mtime) so repeated runs in one process hash it once."""
+    return file_digest(path)
+
+
+def fingerprint(weights, **settings):
+    """Hashes model weight files and the decision-relevant run settings into a short fingerprint for Manifest keys."""
+    h = hashlib.blake2b(digest_size=16)
+    for w in weights if isinstance(weights, (list, tuple)) else [weights]:
+        if os.path.isfile(w):
+            st = os.stat(w)
+            h.update(stat_digest(str(w), st.st_size, st.st_mtime_ns).encode())
+        else:
+            h.update(str(w).encode())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class Manifest:
+    """Append-only JSON-lines log of per-image result rows keyed by source path, content hash and run fingerprint, so
+    an interrupted run can be resumed without deciding the same image twice.
+    """
+
+    def __init__(self, path, fingerprint, resume=False, sync_every=100, append=False):
+        """Opens the manifest, loading existing entries when resuming, appending to the existing log without loading it
+        when appending and starting a new log otherwise.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fingerprint = fingerprint
+        self.sync_every = sync_every
+        self.entries = {}  # key -> record, 판정 순서 유지
+        self.digests = {}  # (path, size, mtime_ns) -> content hash, 재시작 시 파일을 다시 읽지 않기 위함
+        self.keys = {}  # path -> (key, stat), --route move로 원본이 옮겨지기 전에 계산
+        self.latest = {}  # path -> 현재 fingerprint로 마지막에 판정된 key, 원본이 옮겨져도 CSV를 다시 만들 수 있게
+        self.pending = 0
+        if resume and self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:  # 중단 시 마지막 줄이 잘렸을 수 있음
+                        continue
+                    self._add(entry)
+        self.file = open(self.path, "a" if resume or append else "w", encoding="utf-8")
+        if self.file.tell():
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read() != b"\n":
+                    self.file.write("\n")  # 잘린 줄 뒤에 이어 쓰지 않도록
+
+    def _key(self, path, digest):
+        """Returns the key of a resolved source path and content hash under this run's fingerprint."""
+        return hashlib.blake2b(f"{path}\0{digest}\0{self.fingerprint}".encode(), digest_size=16).hexdigest()
+
+    def _add(self, entry):
+        """Indexes a loaded or merged entry, tracking it as the latest decision of its path if it has this run's
+        fingerprint.
+        """
+        self.entries[entry["key"]] = entry["record"]
+        self.digests[(entry["path"], entry["size"], entry["mtime"])] = entry["digest"]
+        if entry["key"] == self._key(entry["path"], entry["digest"]):
+            self.latest.pop(entry["path"], None)
+            self.latest[entry["path"]] = entry["key"]
+
+    def _stat(self, path):
+        """Returns (resolved path, size, mtime_ns, content hash) of a source image, hashing only unseen files."""
+        path = str(Path(path).resolve())
+        st = os.stat(path)
+        digest = self.digests.get((path, st.st_size, st.st_mtime_ns)) or file_digest(path)
+        self.digests[(path, st.st_size, st.st_mtime_ns)] = digest
+        return path, st.st_size, st.st_mtime_ns, digest
+
+    def key(self, path):
+        """Returns the manifest key of a source image under this run's fingerprint."""
+        if path not in self.keys:
+            stat = self._stat(path)
+            self.keys[path] = self._key(stat[0], stat[3]), stat
+        return self.keys[path][0]
+
+    def done(self, path):
+        """Returns True if the image was already decided with identical content, weights and thresholds."""
+        return self.key(path) in self.entries
+
+    def write(self, path, record):
+        """Appends the result row of one image, flushed to the OS immediately and fsynced every `sync_every` rows."""
+        key = self.key(path)
+        record = [str(x) for x in record]
+        path, size, mtime, digest = self.keys[path][1]
+        entry = {"key": key, "path": path, "size": size, "mtime": mtime, "digest": digest, "record": record}
+        self._add(entry)
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+
+    def merge(self, path):
+        """Appends the entries of another manifest (e.g. a --workers shard) to this one and deletes it."""
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._add(entry)
+                self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        os.remove(path)
+
+    def records(self):
+        """Returns the latest recorded row of every source path decided under this run's fingerprint, in the order
+        they were decided. Built from the manifest alone, so images already moved out of the source (--route move) or
+        decided by earlier runs on other files are kept.
+        """
+        return [self.entries[key] for key in self.latest.values()]
+
+    def close(self):
+        """Flushes and fsyncs the manifest and closes it."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def as_rows(x, width):
+    """Returns detection rows (torch tensor, array or None) as a float32 (n, width) NumPy copy."""
+    if x is None:
+        return np.zeros((0, width), np.float32)
+    x = x.detach().cpu().numpy() if hasattr(x, "detach") else x
+    return np.array(x, np.float32).reshape(-1, width)
+
+
+class DetectionStore:
+    """Compact columnar store of the raw per-image detections of a run, saved as one compressed .npz so the rules can
+    be re-applied offline (rejudge.py) without running the models.
+
+    Image columns: path, width, height, kind (0 = other, 1 = Full, 2 = Half), inferred, face_run. Detection columns,
+    indexed by det_offset: box (x1, y1, x2, y2 in original pixels), conf, cls, extent (vertical extent of the person
+    mask in original pixels, NaN if not measured). Face columns of fused runs, indexed by face_offset: face_box (in
+    pixels of the unscaled Half crop), face_conf, face_cls. `meta` holds the class names and run settings as JSON.
+    """
+
+    def __init__(self, path, meta=None, append=False):
+        """Starts an empty store, or one holding the images of an existing store at `path` when appending."""
+        self.path = Path(path)
+        self.meta = dict(meta or {})
+        self.images = {}  # resolved path -> columns, 같은 이미지를 다시 추가하면 마지막 값 사용
+        if append and self.path.exists():
+            self.merge(self.path, remove=False)
+
+    def add(self, path, width, height, det=None, extent=None, face=None, inferred=True):
+        """Adds one image with its (n, 6) xyxy/conf/cls detections, per-detection person extents and face detections
+        (None if the face model did not run on it).
+        """
+        stem = Path(path).stem
+        kind = 1 if "Full" in stem else 2 if "Half" in stem else 0  # predict8_ver4와 같은 순서로 판단
+        det = as_rows(det, 6)
+        extent = np.full(len(det), np.nan, np.float32) if extent is None else as_rows(extent, 1)[:, 0]
+        self.images[str(Path(path).resolve())] = (
+            width, height, kind, inferred, face is not None, det, extent, as_rows(face, 6)
+        )
+
+    def merge(self, path, remove=True):
+        """Adds all images of another store (e.g. a --workers shard), optionally deleting it."""
+        data = self.load(path)
+        self.meta = {**data["meta"], **self.meta}
+        for k, p in enumerate(data["path"]):
+            d = slice(data["det_offset"][k], data["det_offset"][k + 1])
+            f = slice(data["face_offset"][k], data["face_offset"][k + 1])
+            det = np.column_stack([data["box"][d], data["conf"][d], data["cls"][d]])
+            face = np.column_stack([data["face_box"][f], data["face_conf"][f], data["face_cls"][f]])
+            self.images[str(p)] = (
+                int(data["width"][k]),
+                int(data["height"][k]),
+                int(data["kind"][k]),
+                bool(data["inferred"][k]),
+                bool(data["face_run"][k]),
+                det.astype(np.float32),
+                data["extent"][d],
+                face.astype(np.float32),
+            )
+        if remove:
+            os.remove(path)
+
+    def save(self):
+        """Writes the store atomically as compressed columnar arrays."""
+        items = list(self.images.items())
+        columns = list(zip(*[v for _, v in items])) if items else [()] * 8
+        width, height, kind, inferred, face_run, dets, extents, faces = columns
+        det = np.concatenate(dets) if dets else np.zeros((0, 6), np.float32)
+        face = np.concatenate(faces) if faces else np.zeros((0, 6), np.float32)
+        data = dict(
+            path=np.array([p for p, _ in items], dtype=str),
+            width=np.array(width, np.int32),
+            height=np.array(height, np.int32),
+            kind=np.array(kind, np.int8),
+            inferred=np.array(inferred, bool),
+            face_run=np.array(face_run, bool),
+            det_offset=np.cumsum([0] + [len(x) for x in dets]).astype(np.int64),
+            box=det[:, :4],
+            conf=det[:, 4],
+            cls=det[:, 5].astype(np.int16),
+            extent=np.concatenate(extents).astype(np.float32) if extents else np.zeros(0, np.float32),
+            face_offset=np.cumsum([0] + [len(x) for x in faces]).astype(np.int64),
+            face_box=face[:, :4],
+            face_conf=face[:, 4],
+            face_cls=face[:, 5].astype(np.int16),
+            meta=np.array(json.dumps(self.meta, default=str)),
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **data)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def load(path):
+        """Loads a saved store as a dict of NumPy columns, with `meta` decoded."""
+        with np.load(path, allow_pickle=False) as f:
+            data = {k: f[k] for k in f.files}
+        data["meta"] = json.loads(str(data["meta"]))
+        return data
+
+    def close(self):
+        """Saves the store."""
+        self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def list_images(source):
+    """Lists the image files of a file/dir/glob/*.txt source in the same sorted order LoadImages uses."""
+    path = source
+    if isinstance(path, str) and Path(path).suffix == ".txt":  # *.txt file with img/dir on each line
+        path = Path(path).read_text().rsplit()
+    files = []
+    for p in sorted(path) if isinstance(path, (list, tuple)) else [path]:
+        p = str(Path(p).resolve())
+        if "*" in p:
+            files.extend(sorted(glob.glob(p, recursive=True)))  # glob
+        elif os.path.isdir(p):
+            files.extend(sorted(glob.glob(os.path.join(p, "*.*"))))  # dir
+        elif os.path.isfile(p):
+            files.append(p)  # files
+        else:
+            raise FileNotFoundError(f"{p} does not exist")
+    return [x for x in files if x.split(".")[-1].lower() in IMG_FORMATS]
+
+
+def read_image_size(path):
+    """Returns (width, height) of an image read from its JPEG/PNG header, without decoding the pixels."""
+    with Image.open(path) as img:
+        return img.size
+
+
+def load_image(path, img_size=640, stride=32, auto=True):
+    """Reads and letterboxes one image the same way LoadImages does, returning (path, im, im0)."""
+    im0 = cv2.imread(path)  # BGR
+    assert im0 is not None, f"Image Not Found {path}"
+    im = letterbox(im0, img_size, stride=stride, auto=auto)[0]  # padded resize
+    im = np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])  # HWC to CHW, BGR to RGB
+    return path, im, im0
+
+
+class PrefetchImages:
+    """Drop-in replacement for LoadImages on image sources that decodes and letterboxes images on a thread or process
+    pool ahead of inference, keeping at most `prefetch` images in flight.
+    """
+
+    def __init__(self, path, img_size=640, stride=32, auto=True, workers=4, prefetch=None, processes=False):
+        """Lists the source images and stores the letterbox and pool settings."""
+        self.files = list_images(path)
+        self.nf = len(self.files)
+        assert self.nf, f"No images found in {path}. Supported formats are:\nimages: {IMG_FORMATS}"
+        self.img_size = img_size
+        self.stride = stride
+        self.auto = auto
+        self.workers = workers
+        self.prefetch = prefetch or 2 * workers
+        self.processes = processes
+        self.mode = "image"
+        self.frame = 0
+        self.count = 0
+
+    def __iter__(self):
+        """Yields (path, im, im0s, vid_cap, s) in file order while the next images are decoded in the background."""
+        executor = (ProcessPoolExecutor if self.processes else ThreadPoolExecutor)(max_workers=self.workers)
+        files = iter(self.files)
+        pending = deque()
+
+        def submit():
+            f = next(files, None)
+            if f is not None:
+                pending.append(executor.submit(load_image, f, self.img_size, self.stride, self.auto))
+
+        try:
+            for _ in range(self.prefetch):
+                submit()
+            self.count = 0
+            while pending:
+                path, im, im0 = pending.popleft().result()
+                submit()
+                self.count += 1
+                yield path, im, im0, None, f"image {self.count}/{self.nf} {path}: "
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __len__(self):
+        """Returns the number of images in the source."""
+        return self.nf
+
+
+def imwrite_atomic(path, im, sync=True):
+    """Encodes an image by its suffix, writes it to a hidden temp file next to `path` and renames it into place,
+    fsyncing the data first when `sync`.
+    """
+    path = Path(path)
+    ok, buf = cv2.imencode(path.suffix, im)
+    if not ok:
+        raise OSError(f"failed to encode {path}")
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())  # rename 전에 데이터가 디스크에 있어야 crash 후 빈 파일이 남지 않음
+    os.replace(tmp, path)  # 다른 프로세스에서는 완성된 파일만 보임
+
+
+def fsync_path(path):
+    """Fsyncs a file, or a directory so the renames and links made in it survive a crash."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+FICLONE = 0x40049409  # linux/fs.h, copy-on-write clone (btrfs, xfs)
+
+
+def reflink(src, dst):
+    """Clones `src` into a new file `dst` sharing the same data blocks (copy-on-write)."""
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def route_file(src, dst, move=False, sync=True):
+    """Places the source file at `dst` without re-encoding: by rename when `move`, otherwise by hardlink, reflink or
+    byte copy, whichever works first, fsyncing a new copy before its rename when `sync`. Returns the method used.
+    """
+    dst = Path(dst)
+    if move:
+        try:
+            os.replace(src, dst)
+            return "rename"
+        except OSError as e:
+            if e.errno != errno.EXDEV:  # ENOENT, EACCES 등은 그대로 전달
+                raise
+            route_file(src, dst, sync=sync)  # 다른 파일시스템이면 복사 후 삭제
+            os.remove(src)
+            return "copy"
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    for method, fn in (("hardlink", os.link), ("reflink", reflink), ("copy", shutil.copyfile)):
+        try:
+            fn(src, tmp)
+            break
+        except OSError:
+            if method == "copy":
+                raise
+    if sync and method != "hardlink":  # 새 inode는 rename 전에 fsync (imwrite_atomic과 같은 이유)
+        fsync_path(tmp)
+    os.replace(tmp, dst)
+    tmp.unlink(missing_ok=True)  # dst가 이미 같은 inode의 hardlink면 rename이 아무것도 하지 않음
+    return method
+
+
+class ImageWriter:
+    """Encodes and writes routed images on a background thread pool with a bounded number of pending writes, so PNG
+    encoding and disk I/O overlap with inference on the next image. With workers=0 every write is done inline.
+    """
+
+    def __init__(self, workers=0, max_pending=None, route="png"):
+        """Starts the writer pool; `max_pending` images (default 4 per worker) may be queued before write() blocks.
+        `route` selects how unmodified originals are saved: 'png' re-encodes, 'link' hardlinks/reflinks/copies the
+        source file, 'move' renames it.
+        """
+        self.route = route
+        self.spans = None  # optional Spans, times the main-thread cost of each write as 'encode'/'route'
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imwrite") if workers else None
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * workers) if workers else None
+        self.errors = []
+        self.dirs = set()  # close()에서 fsync할 디렉토리
+        self.unsynced = []  # inline으로 쓴 파일, 추론 thread를 막지 않도록 close()에서 fsync
+
+    def write(self, path, im):
+        """Queues `im` to be written to `path`; the array must not be modified afterwards."""
+        self.dirs.add(Path(path).parent)
+        self._submit("encode", imwrite_atomic, path, im, self._sync(path))
+
+    def write_original(self, path, im, source):
+        """Saves the unmodified image of `source` at `path`. In 'link'/'move' route mode the source file itself is
+        placed there under its own suffix, otherwise `im` (decoded from `source` if None) is encoded by `path` suffix.
+        """
+        self.dirs.add(Path(path).parent)
+        if self.route == "move":
+            self.dirs.add(Path(source).parent)  # 원본이 빠져나간 디렉토리
+        if self.route in ("link", "move"):
+            dst = Path(path).with_suffix(Path(source).suffix)
+            self._submit("route", route_file, source, dst, self.route == "move", self._sync(dst))
+        elif im is None:
+            sync = self._sync(path)
+            self._submit("encode", lambda: imwrite_atomic(path, cv2.imread(str(source)), sync))
+        else:
+            self._submit("encode", imwrite_atomic, path, im, self._sync(path))
+
+    def _sync(self, path):
+        """Returns True if the write of `path` fsyncs itself (background pool), otherwise defers it to close()."""
+        if self.executor is None:
+            self.unsynced.append(path)
+        return self.executor is not None
+
+    def _submit(self, stage, fn, *args):
+        """Runs fn(*args) inline, or on the pool once a queue slot is free."""
+        with self.spans(stage) if self.spans else nullcontext():
+            if self.executor is None:
+                fn(*args)
+                return
+            self.slots.acquire()  # queue가 가득 차면 대기
+            future = self.executor.submit(fn, *args)
+            future.add_done_callback(self._done)
+
+    def _done(self, future):
+        """Releases the queue slot of a finished write and keeps its error, if any."""
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def close(self):
+        """Blocks until every queued write is on disk, then raises the first write error, if any."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for path in self.unsynced + sorted(self.dirs):  # inline으로 쓴 파일 다음 rename/link가 있었던 디렉토리
+            if os.path.exists(path):
+                fsync_path(path)
+        self.unsynced.clear()
+        self.dirs.clear()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Spans:
+    """Nested wall-clock span timer for the pipeline stages of each image.
+
+    `with spans("stage"):` blocks accumulate exclusive (self) time per stage, so the stages of one image add up to its
+    wall time. Batch-level stages recorded before split() are shared evenly by the images of the batch. Every image is
+    emitted as one JSON line and, optionally, every span as a Chrome trace event (chrome://tracing or ui.perfetto.dev).
+    Both outputs are streamed as the spans finish; the trace is a JSON array that stays loadable if the run crashes.
+    """
+
+    def __init__(self, jsonl_path=None, trace_path=None, records=None, sync=None):
+        """Opens the outputs; `records` is an optional list that also receives each image record, `sync` an optional
+        callable (e.g. torch.cuda.synchronize) run at span boundaries so asynchronous device work is attributed
+        correctly.
+        """
+        self.file = open(jsonl_path, "w", encoding="utf-8") if jsonl_path else None
+        self.trace = open(trace_path, "w", encoding="utf-8") if trace_path else None
+        if self.trace:
+            self.trace.write("[")  # Chrome/Perfetto는 닫히지 않은 배열도 읽음
+        self.sep = "\n"  # 첫 event 뒤부터 ",\n"
+        self.records = records
+        self.sync = sync
+        self.stack = []  # [name, start, child time]
+        self.current = {}  # stage -> ms, 현재 이미지 (또는 split 전 batch)
+        self.shared = {}  # stage -> ms, batch 단계를 이미지 수로 나눈 값
+        self.t0 = self.image_t0 = time.perf_counter()
+        self.pid = os.getpid()
+
+    @contextmanager
+    def __call__(self, name):
+        """Times the enclosed block as stage `name`, excluding the time of nested spans."""
+        if self.sync:
+            self.sync()
+        self.stack.append([name, time.perf_counter(), 0.0])
+        try:
+            yield
+        finally:
+            if self.sync:
+                self.sync()
+            name, start, child = self.stack.pop()
+            duration = time.perf_counter() - start
+            self._record(name, start, duration, duration - child)
+
+    def add(self, name, start, duration):
+        """Records a span measured outside a with-block, e.g. the wait on a dataloader iterator."""
+        self._record(name, start, duration, duration)
+
+    def _record(self, name, start, duration, self_time):
+        """Adds a finished span to the current image and, if tracing, appends it to the trace file."""
+        self.current[name] = self.current.get(name, 0.0) + self_time * 1e3
+        if self.stack:
+            self.stack[-1][2] += duration
+        if self.trace:
+            ts, dur = (start - self.t0) * 1e6, duration * 1e6  # us
+            event = {"name": name, "ph": "X", "ts": ts, "dur": dur, "pid": self.pid, "tid": threading.get_ident()}
+            self.trace.write(self.sep + json.dumps(event))
+            self.sep = ",\n"
+
+    def split(self, n):
+        """Spreads the spans recorded so far (the batch-level stages) evenly over the `n` images of the batch."""
+        self.shared = {k: v / n for k, v in self.current.items()}
+        self.current = {}
+        self.image_t0 = time.perf_counter()
+
+    def image_done(self, file, rest=None):
+        """Emits the record of the finished image and starts the next one. Time since the previous image that no span
+        covered is reported as stage `rest`, if given.
+        """
+        now = time.perf_counter()
+        record = {"file": str(file), **self.shared}
+        for k, v in self.current.items():
+            record[k] = record.get(k, 0.0) + v
+        if rest:
+            record[rest] = record.get(rest, 0.0) + max(0.0, (now - self.image_t0) * 1e3 - sum(self.current.values()))
+        record["done"] = now
+        self.current = {}
+        self.image_t0 = now
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+        if self.records is not None:
+            self.records.append(record)
+        return record
+
+    def close(self):
+        """Closes the JSON-lines output and terminates the Chrome trace array."""
+        if self.file:
+            self.file.close()
+        if self.trace:
+            self.trace.write("\n]\n")
+            self.trace.close()
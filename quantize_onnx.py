@@ -0,0 +1,201 @@
+"""
+INT8 quantization of the Process1 seg model and the Process2 face model for CPU-only ONNX Runtime inference.
+
+The fp32 ONNX export (export_onnx.py, exported here when a .pt is given) is quantized with ONNX Runtime static QDQ
+quantization: int8 per-channel weights and uint8 activations whose ranges are calibrated on our own images. The box
+decode ops of the Detect/Segment head stay fp32. The result <model>-int8.onnx keeps the stride/names metadata, so
+predict8_ver4.py and detect_Face3.py load it like any other .onnx (ONNX Runtime only, not --dnn).
+
+The agreement step runs the fused Process1 -> Process2 pipeline once with the fp32 models and once with the int8
+models on --eval-source and compares the O/X decisions per file. Flips are broken down by the fp32 -> int8 Note
+(person/class count, height, size, face area) and the int8 models are accepted only if the flip rate is within
+--tolerance. The report is saved as <seg model>-int8.agreement.json.
+
+Usage:
+    $ python quantize_onnx.py --weights yolov5l-seg.pt --face-weights face_detection_yolov5s.pt \\
+                              --calib-source Raw_data/calib --eval-source Raw_data/eval --tolerance 0.01
+    $ python predict8_ver4.py --weights yolov5l-seg-int8.onnx --face-weights face_detection_yolov5s-int8.onnx ...
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from utils.general import LOGGER, check_requirements, increment_path, print_args
+
+from benchmark import agreement, bench, read_decisions
+from export_onnx import export_model
+from process_utils import list_images, load_image
+
+
+class ImageCalibrationReader:
+    """Feeds letterboxed calibration images to the ONNX Runtime quantizer, one {input name: 1x3xHxW} dict per call."""
+
+    def __init__(self, onnx_path, source, max_images=200):
+        """Reads the static input name and size of the fp32 model and lists up to `max_images` source images."""
+        import onnx
+
+        (inp,) = [x for x in onnx.load(str(onnx_path), load_external_data=False).graph.input]
+        self.name = inp.name
+        self.imgsz = [d.dim_value for d in inp.type.tensor_type.shape.dim][2:]
+        assert all(self.imgsz), "calibration needs a static ONNX export (export_onnx.py without --dynamic)"
+        self.files = list_images(source)[:max_images]
+        assert self.files, f"no calibration images found in {source}"
+        self.it = iter(self.files)
+
+    def get_next(self):
+        """Returns the next letterboxed image as a float32 input dict, None when done."""
+        path = next(self.it, None)
+        if path is None:
+            return None
+        im = load_image(path, self.imgsz, auto=False)[1]  # export과 같은 고정 입력 크기
+        return {self.name: (im[None] / 255).astype(np.float32)}
+
+    def rewind(self):
+        """Starts over from the first image."""
+        self.it = iter(self.files)
+
+
+def head_nodes(model):
+    """Returns the non-Conv node names of the last module (Detect/Segment head), kept fp32 so box decoding is exact."""
+    ids = [int(n.name.split("/")[1].split(".")[1]) for n in model.graph.node if n.name.startswith("/model.")]
+    prefix = f"/model.{max(ids)}/" if ids else None
+    return [n.name for n in model.graph.node if prefix and n.name.startswith(prefix) and n.op_type != "Conv"]
+
+
+def quantize(weights, source, imgsz=(640, 640), max_images=200, per_channel=True, calibrate_method="minmax"):
+    """Quantizes one .pt/.onnx model to <stem>-int8.onnx calibrated on `source` and returns its path."""
+    check_requirements(("onnx", "onnxruntime"))
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    f = Path(weights)
+    if f.suffix != ".onnx":
+        f = f.with_suffix(".onnx") if f.with_suffix(".onnx").exists() else export_model(f, imgsz)
+    out = f.with_name(f"{f.stem}-int8.onnx")
+    model = onnx.load(str(f))
+    reader = ImageCalibrationReader(f, source, max_images)
+    LOGGER.info(f"Quantizing {f} on {len(reader.files)} calibration images ({calibrate_method})...")
+    quantize_static(
+        str(f),
+        str(out),
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        nodes_to_exclude=head_nodes(model),
+        calibrate_method={"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy}[calibrate_method],
+    )
+    # DetectMultiBackend는 metadata의 stride/names를 읽음 (없으면 class 이름이 사라져 rule이 동작하지 않음)
+    q = onnx.load(str(out))
+    del q.metadata_props[:]
+    q.metadata_props.extend(model.metadata_props)
+    onnx.save(q, str(out))
+    LOGGER.info(f"Saved {out} ({f.stat().st_size / 1e6:.1f}MB fp32 -> {out.stat().st_size / 1e6:.1f}MB int8)")
+    return out
+
+
+def flip_reasons(flips):
+    """Counts flipped files by 'fp32 Note -> int8 Note', e.g. '- -> height failed'."""
+    return dict(Counter(f"{(x['base'] or ('', 'missing'))[1]} -> {(x['other'] or ('', 'missing'))[1]}" for x in flips))
+
+
+def run(
+    weights=ROOT / "yolov5l-seg.pt",  # seg model .pt or fp32 .onnx
+    face_weights=None,  # face model .pt or fp32 .onnx, quantized and compared too if given
+    calib_source=ROOT / "data/images",  # calibration images
+    eval_source=None,  # agreement images, defaults to calib_source (use held-out images when possible)
+    imgsz=(640, 640),  # export/inference size (height, width)
+    calib_images=200,  # max number of calibration images
+    per_channel=True,  # per-channel weight scales
+    calibrate_method="minmax",  # activation range calibration, 'minmax' or 'entropy'
+    conf_thres=0.25,  # confidence threshold for the agreement runs
+    tolerance=0.01,  # max accepted decision flip rate
+    project=ROOT / "runs/quantize",  # save agreement runs to project/name
+    name="exp",  # save agreement runs to project/name
+    exist_ok=False,  # existing project/name ok, do not increment
+):
+    """Quantizes the models, runs fp32 and int8 pipelines on the eval images and writes the agreement report."""
+    weights, face_weights = (x[0] if isinstance(x, (list, tuple)) else x for x in (weights, face_weights))
+    q = dict(imgsz=imgsz, max_images=calib_images, per_channel=per_channel, calibrate_method=calibrate_method)
+    q_weights = quantize(weights, calib_source, **q)
+    q_face = quantize(face_weights, calib_source, **q) if face_weights else None
+
+    save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)
+    csv_name = "process1_2_whole_files.csv" if face_weights else "Process1/class_height_whole_files.csv"
+    models = {
+        "fp32": (Path(weights).with_suffix(".onnx"), Path(face_weights).with_suffix(".onnx") if face_weights else None),
+        "int8": (q_weights, q_face),
+    }
+    config = dict(calib_source=str(calib_source), eval_source=str(eval_source or calib_source), conf_thres=conf_thres)
+    report = {"config": dict(config, **q, models={k: [str(x) for x in v] for k, v in models.items()})}
+    decisions = {}
+    for variant, (w, fw) in models.items():
+        process_dir = save_dir / variant / "Process"
+        kwargs = dict(weights=w, face_weights=fw, source=eval_source or calib_source, imgsz=imgsz)
+        kwargs.update(conf_thres=conf_thres, project=save_dir / variant, exist_ok=True, process_dir=process_dir)
+        kwargs.update(headless=True, route="link")  # 결정만 비교, 이미지 재인코딩 생략
+        report[variant] = bench("predict8_ver4", kwargs, process_dir / csv_name)
+        decisions[variant] = read_decisions(process_dir / csv_name)
+    a = agreement(decisions["fp32"], decisions["int8"])
+    flip_rate = 1 - a["agree"] if a["images"] else 1.0  # 결과가 없으면 (실행 실패) 채택하지 않음
+    report["agreement"] = dict(a, flip_rate=flip_rate, reasons=flip_reasons(a["flips"]), tolerance=tolerance)
+    report["agreement"]["accepted"] = flip_rate <= tolerance
+
+    out = q_weights.with_suffix(".agreement.json")
+    out.write_text(json.dumps(report, indent=2))
+    speed = {k: report[k].get("images_per_sec") for k in ("fp32", "int8")}
+    LOGGER.info(
+        f"int8 vs fp32: {len(a['flips'])}/{a['images']} decisions flipped ({flip_rate:.2%}, "
+        f"tolerance {tolerance:.2%}), {speed['fp32']} -> {speed['int8']} img/s, {report['agreement']['reasons']}"
+    )
+    if not report["agreement"]["accepted"]:
+        LOGGER.warning(f"WARNING ⚠️ int8 flip rate is above the tolerance, keep the fp32 models. See {out}")
+    else:
+        LOGGER.info(f"int8 models accepted. Report saved to {out}")
+    return report
+
+
+def parse_opt():
+    """Parses command-line options for INT8 quantization and the agreement report."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", type=str, default=ROOT / "yolov5l-seg.pt", help="seg model .pt/.onnx")
+    parser.add_argument("--face-weights", nargs="+", type=str, default=None, help="face model .pt/.onnx")
+    parser.add_argument("--calib-source", type=str, default=ROOT / "data/images", help="calibration images")
+    parser.add_argument("--eval-source", type=str, default=None, help="agreement images (default: calib-source)")
+    parser.add_argument("--imgsz", "--img", "--img-size", nargs="+", type=int, default=[640], help="image size h,w")
+    parser.add_argument("--calib-images", type=int, default=200, help="max number of calibration images")
+    parser.add_argument("--no-per-channel", dest="per_channel", action="store_false", help="per-tensor weight scales")
+    parser.add_argument("--calibrate-method", default="minmax", choices=["minmax", "entropy"], help="range calibration")
+    parser.add_argument("--conf-thres", type=float, default=0.25, help="confidence threshold")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="max accepted decision flip rate")
+    parser.add_argument("--project", default=ROOT / "runs/quantize", help="save results to project/name")
+    parser.add_argument("--name", default="exp", help="save results to project/name")
+    parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Runs quantization and the agreement report, exiting with 1 if the int8 models are not accepted."""
+    report = run(**vars(opt))
+    sys.exit(0 if report["agreement"]["accepted"] else 1)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,247 @@
+"""
+Re-applies the Process1 rules (and the Process2 face rule of fused runs) to the detections saved by predict8_ver4.py
+--save-detections, without loading a model, and regenerates the result CSVs and the success/failed routing.
+
+Thresholds can only be raised above the conf_thres/face_conf_thres of the original run: NMS keeps the highest scoring
+box of each cluster first, so dropping low-confidence rows afterwards gives the same detections as a re-run. Images
+whose new decision needs something the run did not measure (e.g. a Half image that newly passes but never went
+through face detection, a size-gated image that was never inferred, or an image whose counts may miss detections
+dropped by the run's --classes filter, --rule-nms or max_det cap) get the Note "re-run needed".
+
+Usage:
+    $ python rejudge.py --store Process/Process1/class_height_detections.npz --process-dir Process_rejudge
+    $ python rejudge.py --store Process/process1_2_detections.npz --height-ratio 0.45 --min-face-pixel 200000 --nosave
+    $ python rejudge.py --store ... --excluded-classes dog cat horse --conf-thres 0.5 --min-pixel 8000000
+"""
+
+import argparse
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from utils.general import LOGGER, colorstr, cv2, print_args
+
+from predict8_ver4 import crop_further, upscale_image
+from process_utils import DetectionStore, ImageWriter, ResultWriter
+from rules import (
+    EXCLUDED_CLASSES,
+    FUSED,
+    HEIGHT_RATIO,
+    MIN_FACE_PIXEL,
+    MIN_PIXEL,
+    PROCESS1,
+    PROCESS2,
+    RERUN,
+    SCALE_FACTOR,
+    image_columns,
+    judge,
+    min_upscale,
+)
+
+FACE_NOTES = ("-",) + tuple(r.note for r in PROCESS2 if r.note != RERUN)  # face 조건까지 간 Half의 Note
+
+
+def first_rows(img, rows, n):
+    """Returns the first of `rows` (in stored NMS order) of each of `n` images, -1 for images without one."""
+    first = np.full(n, -1)
+    k, j = np.unique(img[rows], return_index=True)
+    first[k] = rows[j]
+    return first
+
+
+def store_columns(data, names, face_names=None, conf_thres=0.0, face_conf_thres=0.0,
+                  excluded_classes=EXCLUDED_CLASSES, min_pixel=MIN_PIXEL, classes=None, max_det=None):
+    """
+    Builds the rule columns of every image of a loaded detection store with array operations only.
+
+    Args:
+        data (dict[str, np.ndarray]): Columns from DetectionStore.load().
+        names (dict[int, str]): Seg model class names.
+        face_names (dict[int, str] | None): Face model class names, None for Process1-only runs.
+        conf_thres, face_conf_thres (float): Detections at or below these are dropped before counting.
+        excluded_classes (tuple[str]): Classes that fail an image.
+        min_pixel (int): Upscale target, face areas are measured in the upscaled crop like the live run.
+        classes (list[int] | None): Class filter of the run, None if every class was kept.
+        max_det (int | None): Detection cap of the run, None if unknown.
+
+    Returns:
+        (tuple[dict[str, np.ndarray], np.ndarray]): Columns for rules.judge() and the det row of each image's person
+            (-1 if none).
+    """
+    n = len(data["path"])
+    img = np.repeat(np.arange(n), np.diff(data["det_offset"]))
+    label = np.array([names.get(k, "") for k in range(max(names) + 1)])[data["cls"].astype(int)]
+    keep = data["conf"] > conf_thres  # non_max_suppression, sweep.grid_counts: conf > conf_thres
+    person, excluded = keep & (label == "person"), keep & np.isin(label, excluded_classes)
+    person_row = first_rows(img, np.flatnonzero(person), n)
+    # class filter 밖의 class는 저장되지 않았고, max_det에 걸린 이미지는 conf가 더 낮은 detection이 잘렸을 수 있음
+    # (하나라도 새 conf_thres에서 빠지면 잘린 것도 모두 빠지므로 그대로 정확)
+    counts_known = np.full(n, classes is None or {"person", *excluded_classes} <= {names.get(k) for k in classes})
+    if max_det is not None:
+        stored = np.diff(data["det_offset"])
+        counts_known &= ~((stored >= max_det) & (np.bincount(img[keep], minlength=n) == stored))
+    extent = np.where(person_row >= 0, data["extent"][np.maximum(person_row, 0)] if len(img) else np.nan, np.nan)
+
+    face_count, face_area = np.zeros(n, np.int64), np.full(n, np.nan)
+    if face_names:
+        fimg = np.repeat(np.arange(n), np.diff(data["face_offset"]))
+        flabel = np.array([face_names.get(k, "") for k in range(max(face_names) + 1)])[data["face_cls"].astype(int)]
+        face = np.flatnonzero((data["face_conf"] > face_conf_thres) & (flabel == "Face"))
+        scale = min_upscale(data["width"], data["height"], min_pixel)[0]
+        box = (data["face_box"] * scale[fimg, None]).round()  # 저장되는 업스케일 crop 좌표
+        area = (box[:, 2] - box[:, 0]) * (box[:, 3] - box[:, 1])
+        face_count = np.bincount(fimg[face], minlength=n)
+        top = first_rows(fimg, face, n)
+        face_area = np.where(top >= 0, area[np.maximum(top, 0)] if len(fimg) else np.nan, np.nan)
+
+    cols = image_columns(
+        data["width"],
+        data["height"],
+        data["kind"],
+        np.bincount(img[person], minlength=n),
+        np.bincount(img[excluded], minlength=n),
+        extent,
+        data["inferred"],
+        data["face_run"],
+        face_count,
+        face_area,
+        counts_known,
+    )
+    return cols, person_row
+
+
+def destination(path, success, note, kind, scaled, fused):
+    """Returns the (dir key, file name, is Half crop) routing of one re-judged image, None if it is not routed."""
+    stem, suffix = Path(path).stem, "_scaled" if scaled else ""
+    if note == "Size failed":
+        return "failed", f"{stem}_scaled_failed", False
+    if note in ("class failed", "no segments", "height failed"):
+        name = Path(path).name if note == "class failed" else f"{stem}{suffix if note == 'height failed' else ''}"
+        return "failed", name, False
+    if kind == 1 and success == "O":
+        return "full_success", f"{stem}{suffix}", False
+    if kind == 2 and note in FACE_NOTES:
+        return note if fused else "half_class_success", f"{stem}{suffix}", True
+    return None
+
+
+def run(
+    store=ROOT / "Process/Process1/class_height_detections.npz",  # detection store saved with --save-detections
+    process_dir=ROOT / "Process_rejudge",  # output root for the regenerated CSVs and routed images
+    conf_thres=None,  # seg confidence threshold, default = the run's (can only be raised)
+    face_conf_thres=None,  # face confidence threshold, default = the run's (can only be raised)
+    min_pixel=MIN_PIXEL,  # minimum image pixels (after upscale)
+    scale_factor=SCALE_FACTOR,  # maximum upscale factor
+    height_ratio=HEIGHT_RATIO,  # Full images: person height >= height_ratio * image height
+    excluded_classes=EXCLUDED_CLASSES,  # classes that fail an image
+    min_face_pixel=MIN_FACE_PIXEL,  # fused runs: minimum face box area in the saved crop
+    route="link",  # save unmodified originals as 'png', 'link' or 'move', crops are always encoded
+    nosave=False,  # only write the CSVs
+    write_workers=4,  # background image write threads
+):
+    """Loads a detection store, re-applies the rules with the given thresholds and writes CSVs and routed images."""
+    data = DetectionStore.load(store)
+    meta = data["meta"]
+    names = {int(k): v for k, v in meta["names"].items()}
+    face_names = {int(k): v for k, v in meta["face_names"].items()} if meta.get("face_names") else None
+    conf_thres = meta["conf_thres"] if conf_thres is None else conf_thres
+    face_conf_thres = meta["face_conf_thres"] if face_conf_thres is None else face_conf_thres
+    if conf_thres < meta["conf_thres"] or face_conf_thres < meta["face_conf_thres"]:
+        LOGGER.warning(f"WARNING ⚠️ thresholds below the run's {meta['conf_thres']}/{meta['face_conf_thres']} "
+                       f"cannot bring back dropped detections")
+
+    if meta.get("classes") is not None:  # --classes / --rule-nms 실행
+        missing = sorted({"person", *excluded_classes} - {names.get(k) for k in meta["classes"]})
+        if missing:
+            LOGGER.warning(f"WARNING ⚠️ {missing} were not kept by the run (classes={meta['classes']}), "
+                           f"images they could fail get '{RERUN}'")
+    if "max_det" not in meta:
+        LOGGER.warning("WARNING ⚠️ the store does not record the run's classes/max_det, counts are taken as complete")
+
+    # 모든 이미지를 한 번에 판정, 이후 loop는 CSV와 routing만
+    cols, person_row = store_columns(
+        data, names, face_names, conf_thres, face_conf_thres, tuple(excluded_classes), min_pixel,
+        meta.get("classes"), meta.get("max_det"),
+    )
+    thresholds = dict(min_pixel=min_pixel, scale_factor=scale_factor, height_ratio=height_ratio,
+                      min_face_pixel=min_face_pixel)
+    success, note, current_pixel = judge(FUSED if face_names else PROCESS1, cols, **thresholds)
+    scale = min_upscale(cols["width"], cols["height"], min_pixel)[0]
+    face_pixel = cols["is_half"] & cols["face_run"] & (cols["face_count"] > 0) & np.isin(note, FACE_NOTES)
+
+    process_dir = Path(process_dir)
+    dirs = {
+        "half_class_success": process_dir / "Process1/half_class_success",
+        "full_success": process_dir / "Process1/full_success",
+        "failed": process_dir / "Process1/class_height_failed",
+        "-": process_dir / "Process2/face_size_success",
+        "face size failed": process_dir / "Process2/face_size_failed",
+        "face detection failed": process_dir / "Process2/face_detection_failed",
+    }
+    columns = ["File_name", "Success", "Note", "Current pixel"] + (["Face pixel"] if face_names else [])
+    csv_path = process_dir / ("process1_2_whole_files.csv" if face_names else "Process1/class_height_whole_files.csv")
+    failed_csv_path = csv_path.with_name(csv_path.name.replace("whole_files", "failed_files"))
+    image_writer = ImageWriter(workers=0 if nosave else write_workers, route=route)
+    notes = Counter(zip(success.tolist(), note.tolist()))
+    with ResultWriter(csv_path, failed_csv_path, columns) as result_writer:
+        for k, path in enumerate(data["path"].tolist()):
+            record = [Path(path).stem, success[k].item(), note[k].item(), str(current_pixel[k])]  # numpy str -> str
+            if face_names:
+                record.append(str(cols["face_area"][k].item()) if face_pixel[k] else "-")
+            result_writer.write(record)
+            dst = destination(path, record[1], record[2], cols["kind"][k], scale[k] > 1, bool(face_names))
+            if nosave or dst is None or not os.path.exists(path):
+                continue
+            key, file_name, crop = dst
+            dirs[key].mkdir(parents=True, exist_ok=True)
+            if not crop:
+                image_writer.write_original(dirs[key] / f"{file_name}.png", None, path)
+            else:  # Half crop만 다시 디코딩
+                im = crop_further(cv2.imread(str(path)), data["box"][person_row[k]])
+                image_writer.write(dirs[key] / f"{file_name}.png", upscale_image(im, scale[k]) if scale[k] > 1 else im)
+    image_writer.close()
+
+    LOGGER.info(f"Re-judged {len(data['path'])} images: " + ", ".join(f"{s} {n}: {c}" for (s, n), c in notes.items()))
+    if notes[("X", RERUN)]:
+        LOGGER.warning(f"WARNING ⚠️ {notes[('X', RERUN)]} images need a re-run with the model ('{RERUN}')")
+    LOGGER.info(f"Results saved to {colorstr('bold', csv_path)}")
+    return notes
+
+
+def parse_opt():
+    """Parses command-line options for offline re-judging."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", type=str, required=True, help="detection store .npz from --save-detections")
+    parser.add_argument("--process-dir", default=ROOT / "Process_rejudge", help="output root for CSVs and images")
+    parser.add_argument("--conf-thres", type=float, default=None, help="seg confidence threshold (>= the run's)")
+    parser.add_argument("--face-conf-thres", type=float, default=None, help="face confidence threshold (>= the run's)")
+    parser.add_argument("--min-pixel", type=int, default=MIN_PIXEL, help="minimum image pixels after upscale")
+    parser.add_argument("--scale-factor", type=float, default=SCALE_FACTOR, help="maximum upscale factor")
+    parser.add_argument("--height-ratio", type=float, default=HEIGHT_RATIO, help="Full: min person height / height")
+    parser.add_argument("--excluded-classes", nargs="*", default=list(EXCLUDED_CLASSES), help="classes that fail")
+    parser.add_argument("--min-face-pixel", type=int, default=MIN_FACE_PIXEL, help="minimum face box area")
+    parser.add_argument("--route", default="link", choices=["png", "link", "move"], help="how to save originals")
+    parser.add_argument("--nosave", action="store_true", help="only write the CSVs")
+    parser.add_argument("--write-workers", type=int, default=4, help="number of background image write threads")
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Runs the re-judge with the parsed options."""
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,154 @@
+"""
+Declarative Process1/Process2 acceptance rules, evaluated with NumPy over the columns of many images at once.
+
+A rule names the Note it produces, the column it checks, a comparison and a threshold (a number or the name of a
+parameter), and optionally the boolean column of images it applies to. An image fails on the first rule, in order,
+whose comparison is true, and gets that rule's Note; images that fail no rule get "-". The same rules decide images
+one at a time in predict8_ver4.py and detect_Face3.py and whole detection stores in rejudge.py and sweep.py.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+MIN_PIXEL = 8200000  # 원본(또는 업스케일 후) 이미지 최소 픽셀 수
+SCALE_FACTOR = 2  # 820만 픽셀 미만일 때 허용하는 최대 업스케일 배율
+EXCLUDED_CLASSES = ("bird", "cat", "dog", "horse", "cow", "elephant", "bear", "zebra", "giraffe")  # 있으면 실패
+HEIGHT_RATIO = 0.5  # Full: 사람 키 >= 이미지 높이 * 0.5
+MIN_FACE_PIXEL = 250000  # Process2: face box 최소 면적
+RERUN = "re-run needed"  # 저장된 detection에 없는 값이 필요한 판정 (rejudge)
+
+PARAMS = dict(min_pixel=MIN_PIXEL, scale_factor=SCALE_FACTOR, height_ratio=HEIGHT_RATIO, min_face_pixel=MIN_FACE_PIXEL)
+
+Rule = namedtuple("Rule", "note column op value when", defaults=(None,))
+OPS = {"<": np.less, "<=": np.less_equal, ">": np.greater, "==": np.equal, "!=": np.not_equal}
+
+# 순서대로 검사, 처음 실패한 rule의 note가 Note
+PROCESS1 = (
+    Rule("Size failed", "pixels", "<", "min_source_pixel", when="not_inferred"),  # --size-gate: header 크기만으로 실패
+    Rule(RERUN, "inferred", "==", False),
+    Rule("class failed", "person_count", ">", 1),
+    Rule("class failed", "excluded_count", ">", 0),
+    Rule(RERUN, "counts_known", "==", False),  # 실행 시 class filter/max_det로 빠진 detection이 판정을 바꿀 수 있음
+    Rule("class failed", "person_count", "<", 1),
+    Rule(RERUN, "extent_known", "==", False),
+    Rule("no segments", "person_extent", "<=", 0),
+    Rule("Size failed", "pixels", "<", "min_source_pixel"),  # 최대 배율로 업스케일해도 부족
+    Rule("height failed", "person_ratio", "<", "height_ratio", when="is_full"),  # 키와 높이는 같은 배율로 커짐
+)
+PROCESS2 = (
+    Rule(RERUN, "face_run", "==", False),
+    Rule("face detection failed", "face_count", "!=", 1),
+    Rule("face size failed", "face_area", "<", "min_face_pixel"),
+)
+FUSED = PROCESS1 + tuple(r._replace(when="is_half") for r in PROCESS2)  # Half는 Process1 통과 후 face 조건
+PROCESS1_NOTES = tuple(dict.fromkeys(r.note for r in PROCESS1 if r.note != RERUN))
+
+
+def image_columns(
+    width=0,
+    height=0,
+    kind=0,
+    person_count=0,
+    excluded_count=0,
+    person_extent=np.nan,
+    inferred=True,
+    face_run=True,
+    face_count=0,
+    face_area=np.nan,
+    counts_known=True,
+):
+    """
+    Builds the rule columns of one image (scalars) or many images (equal-length arrays, or broadcastable arrays such as
+    (settings, images) counts of a threshold sweep).
+
+    Args:
+        width, height (int | np.ndarray): Original image size in pixels.
+        kind (int | np.ndarray): 1 for Full, 2 for Half, 0 for other file names.
+        person_count, excluded_count (int | np.ndarray): Number of person / EXCLUDED_CLASSES detections.
+        person_extent (float | np.ndarray): Vertical extent of the person mask in original pixels, 0 if no segment,
+            NaN if not measured.
+        inferred (bool | np.ndarray): False for images decided from their header only (--size-gate).
+        face_run (bool | np.ndarray): False if the face model never ran on the image's Half crop.
+        face_count (int | np.ndarray): Number of Face detections.
+        face_area (float | np.ndarray): Box area of the top Face in saved-crop pixels, NaN without faces.
+        counts_known (bool | np.ndarray): False if detections the counts need may have been dropped by the run's class
+            filter or max_det cap (rejudge), so only more detections could change the decision.
+
+    Returns:
+        (dict[str, np.ndarray]): Raw and derived columns, one row per image.
+    """
+    c = dict(width=width, height=height, kind=kind, person_count=person_count, excluded_count=excluded_count)
+    c.update(person_extent=person_extent, inferred=inferred, face_run=face_run, face_count=face_count)
+    c.update(counts_known=counts_known)
+    c = {k: np.atleast_1d(np.asarray(v)) for k, v in dict(c, face_area=face_area).items()}
+    shape = np.broadcast_shapes(*(v.shape for v in c.values()))  # (images,) 또는 sweep의 (settings, images)
+    c = {k: np.broadcast_to(v, shape) for k, v in c.items()}
+    c["pixels"] = c["width"].astype(np.int64) * c["height"]
+    c["is_full"], c["is_half"] = c["kind"] == 1, c["kind"] == 2
+    c["not_inferred"] = ~c["inferred"].astype(bool)
+    c["extent_known"] = ~np.isnan(c["person_extent"].astype(np.float64))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c["person_ratio"] = c["person_extent"] / np.maximum(c["height"], 1)
+    return c
+
+
+def params(**overrides):
+    """Returns the rule parameters with overrides and the derived min_source_pixel (before the maximum upscale)."""
+    p = dict(PARAMS, **{k: v for k, v in overrides.items() if v is not None})
+    p["min_source_pixel"] = p["min_pixel"] / p["scale_factor"] ** 2
+    return p
+
+
+def evaluate(rules, cols, **overrides):
+    """
+    Evaluates `rules` over image columns in one vectorized pass.
+
+    Args:
+        rules (tuple[Rule]): Ordered rules, e.g. PROCESS1, PROCESS2 or FUSED.
+        cols (dict[str, np.ndarray]): Image columns from image_columns().
+        **overrides: Rule parameters (min_pixel, scale_factor, height_ratio, min_face_pixel), broadcastable arrays
+            allowed, e.g. a (k, 1) grid of thresholds for a sweep.
+
+    Returns:
+        (tuple[np.ndarray, np.ndarray, np.ndarray]): Success ('O'/'X'), Note and index of the first failing rule (-1
+            if none) per image.
+    """
+    p = params(**overrides)
+    fails = []
+    for rule in rules:
+        value = p[rule.value] if isinstance(rule.value, str) else rule.value
+        fail = OPS[rule.op](cols[rule.column], value)
+        fails.append(fail & cols[rule.when] if rule.when else fail)
+    fails = np.stack(np.broadcast_arrays(*fails))  # (rules, ..., images)
+    failed = fails.any(0)
+    first = np.where(failed, fails.argmax(0), -1)
+    notes = np.array([r.note for r in rules] + ["-"])
+    return np.where(failed, "X", "O"), notes[first], first
+
+
+def min_upscale(width, height, min_pixel=MIN_PIXEL):
+    """Returns the smallest factor that brings width x height images to `min_pixel` and their upscaled (width, height),
+    computed without resizing. Works on scalars and arrays.
+    """
+    scale = np.maximum(1.0, np.sqrt(min_pixel / (np.asarray(width, np.float64) * height)))
+    return scale, (np.ceil(width * scale).astype(np.int64), np.ceil(height * scale).astype(np.int64))
+
+
+def judge(rules, cols, **overrides):
+    """
+    Evaluates `rules` and derives the CSV columns of the decision.
+
+    Images that pass Process1 are upscaled to min_pixel when smaller, so their Current pixel is the upscaled pixel
+    count; images that are neither Full nor Half and fail no rule are left undecided ('').
+
+    Returns:
+        (tuple[np.ndarray, np.ndarray, np.ndarray]): Success, Note and Current pixel per image.
+    """
+    success, note, _ = evaluate(rules, cols, **overrides)
+    p = params(**overrides)
+    _, (w, h) = min_upscale(cols["width"], cols["height"], p["min_pixel"])
+    passed = ~np.isin(note, PROCESS1_NOTES + (RERUN,))
+    current_pixel = np.where(passed & (cols["pixels"] < p["min_pixel"]), w * h, cols["pixels"])
+    success = np.where((note == "-") & (cols["kind"] == 0), "", success)
+    return success, note, current_pixel
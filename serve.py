@@ -0,0 +1,475 @@
+"""
+Local inference server for the Process1 seg model and the Process2 face model, shared by the notebooks, ad-hoc
+scripts and other tools instead of each loading its own copy.
+
+Both models stay loaded in one process behind a ThreadingHTTPServer on a TCP port or a Unix socket. Each model has a
+dynamic batching queue: concurrent requests are grouped into one forward pass of up to --max-batch images, waiting at
+most --max-wait seconds after the first one. A request gets the Process1 decision (rules.PROCESS1), the Process2 face
+decision for Half images that pass it, and the raw detections of both models in original / Half-crop pixels.
+
+Endpoints:
+    POST /predict?name=<file name>  body: encoded image bytes, or JSON {"path": "<local image path>"}
+    GET  /health, GET /stats        batch size statistics of both queues
+
+Usage:
+    $ python serve.py --weights yolov5l-seg.pt --face-weights face_detection_yolov5s.pt --port 8765
+    $ python serve.py --weights yolov5l-seg.pt --unix /tmp/yolo.sock --max-batch 16 --max-wait 0.01
+    $ curl --data-binary @Raw_data/a_Half.jpg "http://127.0.0.1:8765/predict?name=a_Half.jpg"
+
+Load test against a running server (throughput and p50/p99 latency):
+    $ python serve.py --load-test --source Raw_data --requests 500 --concurrency 16 --port 8765
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlparse
+
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from utils.augmentations import letterbox
+from utils.general import LOGGER, check_img_size, colorstr, cv2, non_max_suppression, print_args, scale_boxes
+from utils.torch_utils import smart_inference_mode
+
+from detect_Face3 import face_condition
+from predict8_ver4 import crop_further, load_models, stack
+from process_utils import list_images
+from rules import EXCLUDED_CLASSES, PROCESS1, image_columns, judge, min_upscale
+from sweep import person_extent
+
+
+class DynamicBatcher:
+    """Runs `fn` on batches of concurrently submitted items in one worker thread, grouping up to `max_batch` items and
+    waiting at most `max_wait` seconds after the first one.
+    """
+
+    def __init__(self, fn, max_batch=8, max_wait=0.005, name="batcher"):
+        """Starts the worker thread."""
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.sizes = Counter()  # batch size -> 횟수 (/stats)
+        self.thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Queues one item and returns a Future of its result."""
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def _loop(self):
+        """Collects and runs batches until a None item is queued."""
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch, deadline = [first], time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    x = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if x is None:  # close(): 이번 batch를 처리한 뒤 종료
+                    self.queue.put(None)
+                    break
+                batch.append(x)
+            items, futures = zip(*batch)
+            self.sizes[len(batch)] += 1
+            try:
+                results = self.fn(list(items))
+            except Exception as e:  # 같은 batch의 요청 모두에 전달
+                for f in futures:
+                    f.set_exception(e)
+            else:
+                for f, r in zip(futures, results):
+                    f.set_result(r)
+
+    def stats(self):
+        """Returns the number of batches and the mean batch size."""
+        n = sum(self.sizes.values())
+        return {"batches": n, "mean_batch": sum(k * v for k, v in self.sizes.items()) / n if n else 0.0}
+
+    def close(self):
+        """Stops the worker after the queued items."""
+        self.queue.put(None)
+        self.thread.join()
+
+
+def batch_dynamic(model):
+    """Returns True if the model runs any batch size in one call: PyTorch, dynamic TensorRT engines and ONNX Runtime
+    sessions whose input batch dimension is symbolic (export_onnx.py --dynamic).
+    """
+    if model.pt or getattr(model, "dynamic", False):
+        return True
+    session = getattr(model, "session", None)  # DetectMultiBackend의 ONNX Runtime session
+    return session is not None and not isinstance(session.get_inputs()[0].shape[0], int)
+
+
+def forward(model, ims):
+    """Runs the model on letterboxed CHW uint8 images, in one pass or image by image for fixed-batch exports."""
+    batches = [ims] if batch_dynamic(model) else [[x] for x in ims]
+    outs = []
+    for b in batches:
+        im = torch.from_numpy(stack(b)).to(model.device)
+        outs.append(model((im.half() if model.fp16 else im.float()) / 255))
+    if len(outs) == 1:
+        return outs[0]
+    return [torch.cat(y) for y in zip(*outs)] if isinstance(outs[0], (list, tuple)) else torch.cat(outs)
+
+
+class Pipeline:
+    """Resident seg + face models with one dynamic batching queue each, deciding single images with the rules."""
+
+    def __init__(
+        self,
+        weights,
+        face_weights=None,
+        imgsz=(640, 640),
+        conf_thres=0.25,
+        iou_thres=0.45,
+        face_conf_thres=0.25,
+        max_det=1000,
+        device="",
+        half=False,
+        dnn=False,
+        face_dnn=False,
+        retina_masks=False,
+        max_batch=8,
+        max_wait=0.005,
+    ):
+        """Loads and warms up both models and starts their batching queues."""
+        self.model, self.face_model = load_models(weights, face_weights, device, dnn, face_dnn, half=half)
+        self.imgsz = check_img_size(imgsz, s=self.model.stride)
+        self.conf_thres, self.iou_thres, self.max_det = conf_thres, iou_thres, max_det
+        self.face_conf_thres = face_conf_thres
+        self.retina_masks = retina_masks
+        self.names = self.model.names
+        self.model.warmup(imgsz=(1, 3, *self.imgsz))
+        self.seg = DynamicBatcher(self._seg_batch, max_batch, max_wait, name="seg")
+        self.face = None
+        if self.face_model is not None:
+            self.face_imgsz = check_img_size(imgsz, s=self.face_model.stride)
+            self.face_model.warmup(imgsz=(1, 3, *self.face_imgsz))
+            self.face = DynamicBatcher(self._face_batch, max_batch, max_wait, name="face")
+
+    @smart_inference_mode()
+    def _seg_batch(self, items):
+        """Runs the seg model on a batch of (im, im0 shape) and returns (det in im0 pixels, top person extent)."""
+        ims, shapes = zip(*items)
+        pred, proto = forward(self.model, ims)[:2]
+        pred = non_max_suppression(pred, self.conf_thres, self.iou_thres, max_det=self.max_det, nm=32)
+        out = []
+        for k, det in enumerate(pred):
+            j = next((j for j, c in enumerate(det[:, 5].tolist()) if self.names[int(c)] == "person"), None)
+            extent = np.nan
+            if j is not None:  # Process1에 필요한 mask는 가장 높은 conf의 person 하나
+                extent = person_extent(proto[k], det, j, ims[k].shape[1:], shapes[k], self.retina_masks)
+            det[:, :4] = scale_boxes(ims[k].shape[1:], det[:, :4], shapes[k]).round()
+            out.append((det[:, :6].cpu().numpy(), extent))
+        return out
+
+    @smart_inference_mode()
+    def _face_batch(self, items):
+        """Runs the face model on a batch of (im, crop shape) and returns the detections in crop pixels."""
+        ims, shapes = zip(*items)
+        pred = non_max_suppression(forward(self.face_model, ims), self.face_conf_thres, self.iou_thres)
+        out = []
+        for k, det in enumerate(pred):
+            det[:, :4] = scale_boxes(ims[k].shape[1:], det[:, :4], shapes[k]).round()
+            out.append(det[:, :6].cpu().numpy())
+        return out
+
+    def submit(self, batcher, im0, imgsz, stride):
+        """Letterboxes an image to the fixed batch size and queues it."""
+        im = letterbox(im0, imgsz, stride=stride, auto=False)[0]  # batch로 쌓을 수 있게 고정 크기
+        return batcher.submit((np.ascontiguousarray(im.transpose((2, 0, 1))[::-1]), im0.shape))
+
+    def predict(self, im0, name=""):
+        """Decides one BGR image like the fused predict8_ver4.py run and returns the decision and raw detections."""
+        height, width = im0.shape[:2]
+        stem = Path(name).stem
+        kind = 1 if "Full" in stem else 2 if "Half" in stem else 0
+        det, extent = self.submit(self.seg, im0, self.imgsz, self.model.stride).result()
+        labels = [self.names[int(c)] for c in det[:, 5]]
+        person_count, excluded_count = labels.count("person"), sum(x in EXCLUDED_CLASSES for x in labels)
+        cols = image_columns(width, height, kind, person_count, excluded_count, extent)
+        success, note, current_pixel = (x[0].item() for x in judge(PROCESS1, cols))
+        result = dict(file=name, success=success, note=note, current_pixel=current_pixel, face_pixel="-")
+        result["detections"] = [[*map(float, d[:5]), int(d[5]), self.names[int(d[5])]] for d in det]
+        if success == "O" and kind == 2 and self.face is not None:
+            crop = crop_further(im0, det[labels.index("person"), :4])
+            scale = float(min_upscale(width, height)[0])
+            face = self.submit(self.face, crop, self.face_imgsz, self.face_model.stride).result()
+            scaled = face.copy()
+            scaled[:, :4] = (scaled[:, :4] * scale).round()  # 저장되는 업스케일 crop 좌표 (Process2와 같은 면적)
+            result["success"], result["note"], result["face_pixel"] = face_condition(scaled, self.face_model.names)
+            names = self.face_model.names
+            result["faces"] = [[*map(float, d[:5]), int(d[5]), names[int(d[5])]] for d in face]
+            result["crop_box"] = [float(x) for x in det[labels.index("person"), :4]]
+        return result
+
+    def stats(self):
+        """Returns the batching statistics of both queues."""
+        return {"seg": self.seg.stats(), "face": self.face.stats() if self.face else None}
+
+    def close(self):
+        """Stops both batching queues."""
+        for batcher in (self.seg, self.face):
+            if batcher is not None:
+                batcher.close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """HTTP handler of the /predict, /health and /stats endpoints (keep-alive)."""
+
+    protocol_version = "HTTP/1.1"
+    pipeline = None  # serve()에서 설정
+
+    def address_string(self):
+        """Returns the client address, '' for Unix sockets."""
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        """Logs requests at debug level only."""
+        LOGGER.debug(f"{self.address_string()} {format % args}")
+
+    def reply(self, code, body):
+        """Sends a JSON response."""
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        """Serves /health and /stats."""
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.reply(200, {"status": "ok"})
+        elif path == "/stats":
+            self.reply(200, self.pipeline.stats())
+        else:
+            self.reply(404, {"error": f"unknown endpoint {path}"})
+
+    def do_POST(self):
+        """Serves /predict with an encoded image body or a JSON {"path": ...} body."""
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path != "/predict":
+            return self.reply(404, {"error": f"unknown endpoint {url.path}"})
+        name = parse_qs(url.query).get("name", [""])[0]
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                path = json.loads(body)["path"]
+                im0, name = cv2.imread(path), name or Path(path).name
+            else:
+                im0 = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+            if im0 is None:
+                return self.reply(400, {"error": "could not decode the image"})
+            self.reply(200, self.pipeline.predict(im0, name))
+        except Exception as e:
+            self.reply(500, {"error": repr(e)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ThreadingHTTPServer on a Unix socket."""
+
+    daemon_threads = True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP client connection over a Unix socket."""
+
+    def __init__(self, path, timeout=60):
+        """Connects to the socket at `path` lazily."""
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        """Opens the Unix socket."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def connection(host="127.0.0.1", port=8765, unix=None, timeout=60):
+    """Returns a keep-alive client connection to a running server."""
+    return UnixHTTPConnection(unix, timeout) if unix else http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+def run_load_test(source, requests=200, concurrency=8, host="127.0.0.1", port=8765, unix=None):
+    """
+    Sends `requests` /predict requests with the images of `source` from `concurrency` threads.
+
+    Returns:
+        (dict): Images/sec, p50/p99/mean latency in ms, errors, decision counts and the server's batch statistics.
+    """
+    files = list_images(source)
+    assert files, f"no images found in {source}"
+    payloads = [(Path(f).name, Path(f).read_bytes()) for f in files[:requests]]
+    local = threading.local()
+
+    def send(k):
+        """Posts one image on this thread's connection and returns (latency, decision)."""
+        if not hasattr(local, "conn"):
+            local.conn = connection(host, port, unix)
+        name, data = payloads[k % len(payloads)]
+        t = time.perf_counter()
+        local.conn.request("POST", f"/predict?name={quote(name)}", body=data, headers={"Content-Type": "image/jpeg"})
+        response = local.conn.getresponse()
+        result = json.loads(response.read())
+        return time.perf_counter() - t, (result.get("success"), result.get("note")) if response.status == 200 else None
+
+    send(0)  # 첫 요청 (lazy init)은 측정에서 제외
+    t = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, range(requests)))
+    elapsed = time.perf_counter() - t
+    latency = np.array([x[0] for x in results]) * 1e3
+    conn = connection(host, port, unix)
+    conn.request("GET", "/stats")
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "images_per_sec": round(requests / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latency, 50)), 1),
+        "p99_ms": round(float(np.percentile(latency, 99)), 1),
+        "mean_ms": round(float(latency.mean()), 1),
+        "errors": sum(x[1] is None for x in results),
+        "decisions": {f"{s} {n}": c for (s, n), c in Counter(x[1] for x in results if x[1]).items()},
+        "server": json.loads(conn.getresponse().read()),
+    }
+    LOGGER.info(
+        f"{requests} requests x {concurrency} threads: {report['images_per_sec']} img/s, "
+        f"p50 {report['p50_ms']}ms, p99 {report['p99_ms']}ms, {report['errors']} errors, server {report['server']}"
+    )
+    return report
+
+
+def serve(host="127.0.0.1", port=8765, unix=None, **kwargs):
+    """Loads the pipeline and serves it on a TCP port or a Unix socket until interrupted."""
+    pipeline = Pipeline(**kwargs)
+    handler = type("PipelineHandler", (Handler,), {"pipeline": pipeline})
+    if unix:
+        Path(unix).unlink(missing_ok=True)
+        server = UnixHTTPServer(unix, handler)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+    LOGGER.info(f"Serving on {colorstr('bold', unix or f'http://{host}:{port}')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pipeline.close()
+        if unix:
+            Path(unix).unlink(missing_ok=True)
+
+
+def run(
+    weights=ROOT / "yolov5l-seg.pt",  # seg model path(s)
+    face_weights=None,  # face model path(s), Process2 is skipped if None
+    imgsz=(640, 640),  # inference size (height, width), every image is letterboxed to it for batching
+    conf_thres=0.25,  # confidence threshold
+    iou_thres=0.45,  # NMS IOU threshold
+    face_conf_thres=0.25,  # face confidence threshold
+    max_det=1000,  # maximum detections per image
+    device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+    half=False,  # use FP16 half-precision inference
+    dnn=False,  # use OpenCV DNN for ONNX inference
+    face_dnn=False,  # use OpenCV DNN for an ONNX face model
+    retina_masks=False,  # measure person height on native-resolution masks
+    max_batch=8,  # maximum images per forward pass
+    max_wait=0.005,  # seconds to wait for more requests after the first one of a batch
+    host="127.0.0.1",  # TCP host
+    port=8765,  # TCP port
+    unix=None,  # Unix socket path instead of TCP
+    load_test=False,  # run the load-test client against a running server instead of serving
+    source=ROOT / "data/images",  # load test images
+    requests=200,  # load test request count
+    concurrency=8,  # load test client threads
+):
+    """Serves both models, or load-tests a running server with --load-test."""
+    if load_test:
+        return run_load_test(source, requests, concurrency, host, port, unix)
+    serve(
+        host,
+        port,
+        unix,
+        weights=weights,
+        face_weights=face_weights,
+        imgsz=imgsz,
+        conf_thres=conf_thres,
+        iou_thres=iou_thres,
+        face_conf_thres=face_conf_thres,
+        max_det=max_det,
+        device=device,
+        half=half,
+        dnn=dnn,
+        face_dnn=face_dnn,
+        retina_masks=retina_masks,
+        max_batch=max_batch,
+        max_wait=max_wait,
+    )
+
+
+def parse_opt():
+    """Parses command-line options for the inference server and its load-test client."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", type=str, default=ROOT / "yolov5l-seg.pt", help="seg model path(s)")
+    parser.add_argument("--face-weights", nargs="+", type=str, default=None, help="face model path(s)")
+    parser.add_argument("--imgsz", "--img", "--img-size", nargs="+", type=int, default=[640], help="inference size h,w")
+    parser.add_argument("--conf-thres", type=float, default=0.25, help="confidence threshold")
+    parser.add_argument("--iou-thres", type=float, default=0.45, help="NMS IoU threshold")
+    parser.add_argument("--face-conf-thres", type=float, default=0.25, help="face confidence threshold")
+    parser.add_argument("--max-det", type=int, default=1000, help="maximum detections per image")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
+    parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
+    parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
+    parser.add_argument("--face-dnn", action="store_true", help="use OpenCV DNN for an ONNX face model")
+    parser.add_argument("--retina-masks", action="store_true", help="measure person height on native-resolution masks")
+    parser.add_argument("--max-batch", type=int, default=8, help="maximum images per forward pass")
+    parser.add_argument("--max-wait", type=float, default=0.005, help="seconds to wait for more requests per batch")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--unix", type=str, default=None, help="Unix socket path instead of TCP")
+    parser.add_argument("--load-test", action="store_true", help="load-test a running server")
+    parser.add_argument("--source", type=str, default=ROOT / "data/images", help="load test images")
+    parser.add_argument("--requests", type=int, default=200, help="load test request count")
+    parser.add_argument("--concurrency", type=int, default=8, help="load test client threads")
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Runs the server or the load-test client with the parsed options."""
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
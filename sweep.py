@@ -0,0 +1,394 @@
+"""
+Threshold sweep for the Process1/Process2 rules from a single inference pass.
+
+The seg model runs once per image at a low confidence floor with NMS disabled (IoU 1.0), and every candidate box is
+cached with the mask extent of the top-scoring person. On Half images the face model runs once on the crop of that
+person and its candidate Face boxes are cached too. The cache is reused on later sweeps.
+
+Every (conf, iou, face conf, height ratio, face area) setting is then evaluated from the cache without a model:
+- NMS is redone once per IoU value. Greedy NMS only lets higher-scoring boxes suppress lower ones, so dropping
+  boxes below a confidence threshold after NMS gives the same boxes as NMS at that threshold.
+- The top person always survives per-class NMS. Whenever exactly one person remains, it is the cached one, so its
+  mask extent and Half crop are those of a real run. Class-agnostic NMS is not supported: a higher-scoring box of
+  another class could suppress the top person and leave one whose extent and crop were never cached.
+- Person, excluded and Face counts are computed for the whole conf grid at once, and rules.judge decides all settings
+  and images in one vectorized pass.
+
+Outputs in project/name:
+- sweep_table.csv: pass/fail and Note counts per setting, plus the number of images whose decision differs from the
+  baseline setting.
+- sweep_diffs.csv: the changed images per setting.
+
+Usage:
+    $ python sweep.py --weights yolov5l-seg.pt --face-weights face_detection_yolov5s.pt --source Raw_data \\
+                      --conf-thres 0.2 0.25 0.3 0.4 --iou-thres 0.4 0.45 0.5 --height-ratio 0.45 0.5 \\
+                      --min-face-pixel 200000 250000 300000
+    $ python sweep.py --cache runs/sweep/exp/candidates.npz --conf-thres 0.25 0.35 --height-ratio 0.4 0.5 0.6
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchvision
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
+from utils.dataloaders import LoadImages
+from utils.general import (
+    LOGGER,
+    check_img_size,
+    colorstr,
+    increment_path,
+    non_max_suppression,
+    print_args,
+    scale_boxes,
+    scale_segments,
+)
+from utils.segment.general import masks2segments, process_mask, process_mask_native
+from utils.torch_utils import select_device, smart_inference_mode
+
+from predict8_ver4 import MAX_NMS, crop_further, proto_person_height
+from process_utils import DetectionStore
+from rules import (
+    EXCLUDED_CLASSES,
+    FUSED,
+    HEIGHT_RATIO,
+    MIN_FACE_PIXEL,
+    MIN_PIXEL,
+    PROCESS1,
+    image_columns,
+    judge,
+    min_upscale,
+)
+
+MAX_WH = 7680  # non_max_suppression과 같은 class별 box offset
+
+
+def person_extent(proto, det, j, im_shape, im0_shape, retina_masks=False, proto_height=False):
+    """Returns the vertical mask extent of detection `j` in original pixels (0 without a segment), measured like
+    predict8_ver4.py --save-txt (full masks) or --proto-height (proto-resolution masks only).
+    """
+    if proto_height:
+        return proto_person_height(proto, det[j], im_shape, im0_shape)[0]
+    if retina_masks:
+        box = scale_boxes(im_shape, det[[j], :4].clone(), im0_shape).round()
+        mask = process_mask_native(proto, det[[j], 6:], box, im0_shape[:2])
+    else:
+        mask = process_mask(proto, det[[j], 6:], det[[j], :4], im_shape, upsample=True)
+    segment = masks2segments(mask)[0]
+    if not len(segment):
+        return 0.0
+    segment = scale_segments(im0_shape if retina_masks else im_shape, segment, im0_shape, normalize=True)
+    return float((segment[:, 1].max() - segment[:, 1].min()) * im0_shape[0])
+
+
+def face_candidates(model, crop, imgsz, conf_floor, classes, scale):
+    """Runs the face model on a Half crop without NMS and returns the candidate (letterbox xyxy, conf, cls) rows with
+    their box area in the saved (upscaled) crop, measured like predict8_ver4.py.
+    """
+    im = letterbox(crop, imgsz, stride=model.stride, auto=model.pt)[0]  # detect_faces와 같은 전처리
+    im = torch.from_numpy(np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])).to(model.device)
+    im = (im.half() if model.fp16 else im.float())[None] / 255
+    det = non_max_suppression(model(im), conf_floor, 1.0, classes, max_det=MAX_NMS)[0]
+    box = (scale_boxes(im.shape[2:], det[:, :4].clone(), crop.shape).round() * scale).round()
+    return det[:, :6], (box[:, 2] - box[:, 0]) * (box[:, 3] - box[:, 1])
+
+
+@smart_inference_mode()
+def collect(
+    weights,
+    source,
+    face_weights=None,
+    imgsz=(640, 640),
+    conf_floor=0.05,
+    classes=None,
+    device="",
+    half=False,
+    retina_masks=False,
+    proto_height=False,
+    min_pixel=MIN_PIXEL,
+):
+    """
+    Runs both models once over `source` and returns the candidate cache.
+
+    Returns:
+        (dict[str, np.ndarray]): Image columns path, width, height, kind, extent (top person), face_run; candidate
+            columns indexed by det_offset: box (letterbox xyxy), conf, cls; face columns indexed by face_offset:
+            face_box (letterbox xyxy), face_conf, face_cls, face_area; and `meta`.
+    """
+    device = select_device(device)
+    model = DetectMultiBackend(weights, device=device, fp16=half)
+    stride, names, pt = model.stride, model.names, model.pt
+    imgsz = check_img_size(imgsz, s=stride)
+    model.warmup(imgsz=(1, 3, *imgsz))
+    face_model = DetectMultiBackend(face_weights, device=device, fp16=half) if face_weights else None
+    if face_model is not None:
+        face_imgsz = check_img_size(imgsz, s=face_model.stride)
+        face_classes = [k for k, v in face_model.names.items() if v == "Face"]
+    person = [k for k, v in names.items() if v == "person"]
+
+    images, dets, faces = [], [], []
+    for path, im, im0, _, s in LoadImages(source, img_size=imgsz, stride=stride, auto=pt):
+        im = torch.from_numpy(im).to(device)
+        im = (im.half() if model.fp16 else im.float())[None] / 255
+        pred, proto = model(im)[:2]
+        det = non_max_suppression(pred, conf_floor, 1.0, classes, max_det=MAX_NMS, nm=32)[0]  # NMS 없이 후보 전부
+        kind = 1 if "Full" in Path(path).stem else 2 if "Half" in Path(path).stem else 0
+        top = next((j for j, c in enumerate(det[:, 5].tolist()) if int(c) in person), None)  # conf 순 정렬
+        extent, face, face_run = np.nan, np.zeros((0, 7), np.float32), False
+        if top is not None:
+            extent = person_extent(proto[0], det, top, im.shape[2:], im0.shape, retina_masks, proto_height)
+            box = scale_boxes(im.shape[2:], det[[top], :4].clone(), im0.shape).round()[0]
+            crop = crop_further(im0, box)
+            if face_model is not None and kind == 2 and crop.size:
+                scale = float(min_upscale(im0.shape[1], im0.shape[0], min_pixel)[0])
+                f, area = face_candidates(face_model, crop, face_imgsz, conf_floor, face_classes, scale)
+                face, face_run = torch.cat([f, area[:, None]], 1).cpu().numpy(), True
+        images.append((path, im0.shape[1], im0.shape[0], kind, extent, face_run))
+        dets.append(det[:, :6].cpu().numpy())
+        faces.append(face)
+        LOGGER.info(f"{s}{len(det)} candidates, {len(face)} face candidates")
+
+    path, width, height, kind, extent, face_run = zip(*images) if images else [()] * 6
+    det = np.concatenate(dets) if dets else np.zeros((0, 6), np.float32)
+    face = np.concatenate(faces) if faces else np.zeros((0, 7), np.float32)
+    meta = dict(
+        weights=str(weights),
+        face_weights=str(face_weights) if face_weights else None,
+        imgsz=list(imgsz),
+        conf_floor=conf_floor,
+        min_pixel=min_pixel,
+        retina_masks=retina_masks,
+        proto_height=proto_height,
+        names=names,
+        face_names=face_model.names if face_model is not None else None,
+    )
+    return dict(
+        path=np.array(path, dtype=str),
+        width=np.array(width, np.int32),
+        height=np.array(height, np.int32),
+        kind=np.array(kind, np.int8),
+        extent=np.array(extent, np.float32),
+        face_run=np.array(face_run, bool),
+        det_offset=np.cumsum([0] + [len(x) for x in dets]).astype(np.int64),
+        box=det[:, :4],
+        conf=det[:, 4],
+        cls=det[:, 5].astype(np.int16),
+        face_offset=np.cumsum([0] + [len(x) for x in faces]).astype(np.int64),
+        face_box=face[:, :4],
+        face_conf=face[:, 4],
+        face_cls=face[:, 5].astype(np.int16),
+        face_area=face[:, 6],
+        meta=np.array(json.dumps(meta, default=str)),
+    )
+
+
+def save_cache(path, data):
+    """Writes the candidate cache atomically as one compressed .npz (loaded back with DetectionStore.load)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **data)
+    os.replace(tmp, path)
+
+
+def nms_keep(box, conf, cls, offset, iou_thres):
+    """Returns the kept-row mask of greedy per-class NMS at `iou_thres` for every image of the cache."""
+    keep = np.zeros(len(conf), bool)
+    box, conf, cls = torch.from_numpy(box), torch.from_numpy(conf), torch.from_numpy(cls.astype(np.float32))
+    for a, b in zip(offset[:-1], offset[1:]):
+        if b > a:
+            boxes = box[a:b] + cls[a:b, None] * MAX_WH  # class별 offset (non_max_suppression)
+            keep[a + torchvision.ops.nms(boxes, conf[a:b], iou_thres).numpy()] = True
+    return keep
+
+
+def grid_counts(img, rows, conf, conf_grid, n):
+    """Returns the (len(conf_grid), n) number of `rows` per image with conf above each threshold."""
+    counts = np.zeros((n, len(conf_grid)), np.int64)
+    np.add.at(counts, img[rows], conf[rows, None] > np.asarray(conf_grid))  # non_max_suppression: conf > conf_thres
+    return counts.T
+
+
+def sweep(data, conf_thres, iou_thres, face_conf_thres, height_ratio, min_face_pixel,
+          excluded_classes=EXCLUDED_CLASSES):
+    """
+    Decides every image of a candidate cache under every threshold combination.
+
+    Args:
+        data (dict[str, np.ndarray]): Candidate cache from collect() / DetectionStore.load().
+        conf_thres, iou_thres, face_conf_thres, height_ratio, min_face_pixel (list[float]): Threshold grids. The face
+            model uses the same IoU threshold as the seg model, like predict8_ver4.py.
+        excluded_classes (tuple[str]): Classes that fail an image.
+
+    Returns:
+        (tuple[list[dict], np.ndarray, np.ndarray]): Settings, and (settings, images) Success and Note arrays.
+    """
+    meta = data["meta"]
+    names = {int(k): v for k, v in meta["names"].items()}
+    face_names = {int(k): v for k, v in meta["face_names"].items()} if meta.get("face_names") else None
+    if min(conf_thres + face_conf_thres) < meta["conf_floor"]:
+        LOGGER.warning(f"WARNING ⚠️ thresholds below the cache's conf floor {meta['conf_floor']} see no extra boxes")
+    n = len(data["path"])
+    img = np.repeat(np.arange(n), np.diff(data["det_offset"]))
+    label = np.array([names.get(k, "") for k in range(max(names) + 1)])[data["cls"].astype(int)]
+    fimg = np.repeat(np.arange(n), np.diff(data["face_offset"]))
+
+    # top Face(가장 높은 conf)는 어떤 설정에서도 남으므로 면적은 이미지마다 하나
+    face_area = np.full(n, np.nan)
+    k, j = np.unique(fimg, return_index=True)
+    face_area[k] = data["face_area"][j]
+
+    settings, success, note = [], [], []
+    for iou in iou_thres:
+        keep = nms_keep(data["box"], data["conf"], data["cls"], data["det_offset"], iou)
+        person = grid_counts(img, np.flatnonzero(keep & (label == "person")), data["conf"], conf_thres, n)
+        excluded = keep & np.isin(label, excluded_classes)
+        excluded = grid_counts(img, np.flatnonzero(excluded), data["conf"], conf_thres, n)
+        face = np.zeros((len(face_conf_thres), n), np.int64)
+        if face_names:
+            fkeep = nms_keep(data["face_box"], data["face_conf"], data["face_cls"], data["face_offset"], iou)
+            face = grid_counts(fimg, np.flatnonzero(fkeep), data["face_conf"], face_conf_thres, n)
+        grid = itertools.product(range(len(conf_thres)), range(len(face_conf_thres)), height_ratio, min_face_pixel)
+        grid = list(grid)
+        c, fc, hr, mf = (np.array(x) for x in zip(*grid))
+        cols = image_columns(
+            data["width"],
+            data["height"],
+            data["kind"],
+            person[c],
+            excluded[c],
+            data["extent"],
+            True,
+            data["face_run"],
+            face[fc],
+            face_area,
+        )
+        s, t, _ = judge(FUSED if face_names else PROCESS1, cols, min_pixel=meta["min_pixel"],
+                        height_ratio=hr[:, None], min_face_pixel=mf[:, None])
+        settings += [
+            dict(conf_thres=conf_thres[a], iou_thres=iou, face_conf_thres=face_conf_thres[b], height_ratio=h,
+                 min_face_pixel=m)
+            for a, b, h, m in grid
+        ]
+        success.append(s)
+        note.append(t)
+    return settings, np.concatenate(success), np.concatenate(note)
+
+
+def run(
+    weights=ROOT / "yolov5l-seg.pt",  # seg model path
+    source=ROOT / "data/images",  # images to run once
+    face_weights=None,  # face model path, Process2 face rules are swept too if given
+    cache=None,  # candidate cache .npz, reused if it exists, default project/name/candidates.npz
+    imgsz=(640, 640),  # inference size (height, width)
+    conf_floor=0.05,  # confidence floor of the cached candidates (lowest sweepable conf)
+    conf_thres=(0.25,),  # seg confidence thresholds to sweep
+    iou_thres=(0.45,),  # NMS IoU thresholds to sweep (seg and face)
+    face_conf_thres=(0.25,),  # face confidence thresholds to sweep
+    height_ratio=(HEIGHT_RATIO,),  # Full height ratios to sweep
+    min_face_pixel=(MIN_FACE_PIXEL,),  # minimum face areas to sweep
+    baseline=None,  # index of the setting to diff against, default the predict8_ver4.py defaults or the first
+    classes=None,  # filter by class: --class 0, or --class 0 2 3
+    device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+    half=False,  # use FP16 half-precision inference
+    retina_masks=False,  # measure person height on native-resolution masks
+    proto_height=False,  # measure person height on proto-resolution masks only (faster, approximate near the ratio)
+    project=ROOT / "runs/sweep",  # save results to project/name
+    name="exp",  # save results to project/name
+    exist_ok=False,  # existing project/name ok, do not increment
+):
+    """Builds or loads the candidate cache, sweeps the threshold grid and writes the count table and decision diffs."""
+    save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    cache = Path(cache) if cache else save_dir / "candidates.npz"
+    if not cache.exists():
+        weights, face_weights = (x[0] if isinstance(x, (list, tuple)) else x for x in (weights, face_weights))
+        save_cache(cache, collect(weights, source, face_weights, imgsz, conf_floor, classes, device, half,
+                                  retina_masks, proto_height))
+        LOGGER.info(f"Candidate cache saved to {colorstr('bold', cache)}")
+    data = DetectionStore.load(cache)
+
+    settings, success, note = sweep(data, list(conf_thres), list(iou_thres), list(face_conf_thres),
+                                    list(height_ratio), list(min_face_pixel))
+    if baseline is None:
+        default = dict(conf_thres=0.25, iou_thres=0.45, face_conf_thres=0.25, height_ratio=HEIGHT_RATIO,
+                       min_face_pixel=MIN_FACE_PIXEL)
+        baseline = next((k for k, x in enumerate(settings) if x == default), 0)
+    changed = (success != success[baseline]) | (note != note[baseline])
+
+    stems = [Path(p).stem for p in data["path"]]
+    notes = sorted(set(note.ravel().tolist()))
+    with open(save_dir / "sweep_table.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["setting", *settings[0], "O", "X", *notes, "changed"])
+        for k, x in enumerate(settings):
+            counts = Counter(note[k].tolist())
+            row = [k, *x.values(), int((success[k] == "O").sum()), int((success[k] == "X").sum())]
+            writer.writerow(row + [counts[t] for t in notes] + [int(changed[k].sum())])
+    with open(save_dir / "sweep_diffs.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["setting", "File_name", "Base success", "Base note", "Success", "Note"])
+        for k, i in zip(*np.nonzero(changed)):
+            writer.writerow([k, stems[i], success[baseline, i], note[baseline, i], success[k, i], note[k, i]])
+
+    for k, x in enumerate(settings):
+        LOGGER.info(f"{k}: {x} -> O {(success[k] == 'O').sum()}, X {(success[k] == 'X').sum()}, "
+                    f"{changed[k].sum()} changed")
+    LOGGER.info(f"{len(settings)} settings x {len(stems)} images, baseline {baseline}. "
+                f"Results saved to {colorstr('bold', save_dir)}")
+    return settings, success, note
+
+
+def parse_opt():
+    """Parses command-line options for the threshold sweep."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", type=str, default=ROOT / "yolov5l-seg.pt", help="seg model path")
+    parser.add_argument("--source", type=str, default=ROOT / "data/images", help="file/dir/glob")
+    parser.add_argument("--face-weights", nargs="+", type=str, default=None, help="face model path")
+    parser.add_argument("--cache", type=str, default=None, help="candidate cache .npz (reused if it exists)")
+    parser.add_argument("--imgsz", "--img", "--img-size", nargs="+", type=int, default=[640], help="inference size h,w")
+    parser.add_argument("--conf-floor", type=float, default=0.05, help="confidence floor of the cached candidates")
+    parser.add_argument("--conf-thres", nargs="+", type=float, default=[0.25], help="seg confidence thresholds")
+    parser.add_argument("--iou-thres", nargs="+", type=float, default=[0.45], help="NMS IoU thresholds")
+    parser.add_argument("--face-conf-thres", nargs="+", type=float, default=[0.25], help="face confidence thresholds")
+    parser.add_argument("--height-ratio", nargs="+", type=float, default=[HEIGHT_RATIO], help="Full height ratios")
+    parser.add_argument("--min-face-pixel", nargs="+", type=int, default=[MIN_FACE_PIXEL], help="minimum face areas")
+    parser.add_argument("--baseline", type=int, default=None, help="setting index to diff against")
+    parser.add_argument("--classes", nargs="+", type=int, help="filter by class: --classes 0, or --classes 0 2 3")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
+    parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
+    parser.add_argument("--retina-masks", action="store_true", help="measure person height on native-resolution masks")
+    parser.add_argument("--proto-height", action="store_true", help="measure person height on proto masks only")
+    parser.add_argument("--project", default=ROOT / "runs/sweep", help="save results to project/name")
+    parser.add_argument("--name", default="exp", help="save results to project/name")
+    parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Runs the threshold sweep with the parsed options."""
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,276 @@
+"""
+Daemon mode for the fused Process1 -> Process2 pipeline: keeps the seg and face models resident, watches the source
+directory and decides new images in micro-batches as they land, appending to the existing CSVs and manifest.
+
+New files are picked up with inotify through watchdog when it is installed (polling otherwise, or with --poll). A file
+is taken once it was closed after writing or moved into the directory. Files that only show up as created or
+modified wait until their size and mtime have not changed for --settle seconds. Ready files are grouped into a
+micro-batch of up to --max-batch images or whatever arrived within --max-wait seconds, and each batch goes through
+predict8_ver4.run with the resident models (no import, check_requirements, model load or warmup per batch).
+
+Images already in the directory at startup are skipped unless --catch-up is given. --catch-up decides exactly those
+images like predict8_ver4.py --resume, which also rebuilds the CSVs from the manifest. Files landing meanwhile are
+left to the watcher.
+
+If a micro-batch fails (e.g. an unreadable or vanished file), its files are retried one at a time like --resume, so
+images the batch already recorded are not decided twice. Files that still fail are moved to process_dir/quarantine.
+
+Usage:
+    $ python watch.py --weights yolov5l-seg.pt --face-weights face_detection_yolov5s.pt --source Raw_data \\
+                      --process-dir Process --max-batch 16 --max-wait 0.5
+    $ python watch.py --weights yolov5l-seg.pt --source Raw_data --poll 2 --run-args '{"headless": true}'
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from utils.dataloaders import IMG_FORMATS
+from utils.general import LOGGER, check_requirements, colorstr, print_args
+
+import predict8_ver4
+from process_utils import list_images
+
+
+class SourceWatcher:
+    """Collects image files that land in a directory, with watchdog (inotify on Linux) or by polling."""
+
+    def __init__(self, source, settle=1.0, poll=0.0):
+        """Starts watching `source`, treating the images already in it as seen."""
+        self.source = Path(source).resolve()
+        self.settle = settle
+        self.poll = poll
+        self.seen = set(list_images(str(self.source)))  # 이미 처리했거나 대기 중인 파일
+        self.pending = {}  # path -> (size, mtime_ns, 변화가 없었던 시작 시각), 아직 쓰는 중일 수 있는 파일
+        self.lock = threading.Lock()
+        self.last_scan = 0.0
+        self.observer = None
+        if not poll:
+            try:
+                from watchdog.events import FileSystemEventHandler
+                from watchdog.observers import Observer
+            except ImportError:
+                LOGGER.warning("WARNING ⚠️ watchdog is not installed, polling the source directory every 1s instead")
+                self.poll = 1.0
+            else:
+                watcher = self
+
+                class Handler(FileSystemEventHandler):
+                    def on_any_event(self, event):
+                        """Queues created, written, closed and moved-in files."""
+                        if not event.is_directory:
+                            path = getattr(event, "dest_path", "") or event.src_path  # moved: 옮겨진 경로
+                            watcher.add(path, closed=event.event_type in ("closed", "moved"))
+
+                self.observer = Observer()
+                self.observer.schedule(Handler(), str(self.source), recursive=False)
+                self.observer.start()
+        LOGGER.info(f"Watching {self.source} with {'inotify' if self.observer else f'polling every {self.poll}s'}")
+
+    def add(self, path, closed=False):
+        """Queues an image file, ready immediately if it was closed after writing or moved in."""
+        path = Path(path).resolve()
+        if path.parent != self.source or path.name.startswith("."):  # --route move로 나간 파일, 숨김/임시 파일 제외
+            return
+        path = str(path)
+        if path.split(".")[-1].lower() not in IMG_FORMATS:
+            return
+        with self.lock:
+            if path in self.seen:
+                return
+            if closed:
+                self.pending[path] = (None, None, float("-inf"))
+            else:
+                self.pending.setdefault(path, (None, None, time.monotonic()))
+
+    def scan(self):
+        """Polling fallback: queues unseen images of the directory."""
+        for path in list_images(str(self.source)):
+            self.add(path)
+
+    def ready(self):
+        """Returns the queued files whose writing is finished, marking them as seen."""
+        now = time.monotonic()
+        if self.poll and now - self.last_scan >= self.poll:
+            self.scan()
+            self.last_scan = now
+        done = []
+        with self.lock:
+            for path, (size, mtime, since) in list(self.pending.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:  # 다시 옮겨졌거나 삭제됨
+                    del self.pending[path]
+                    continue
+                unchanged = (st.st_size, st.st_mtime_ns) == (size, mtime)
+                if since == float("-inf") or (unchanged and now - since >= self.settle):
+                    done.append(path)
+                    del self.pending[path]
+                    self.seen.add(path)
+                elif not unchanged:  # 아직 쓰는 중
+                    self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+        return done
+
+    def close(self):
+        """Stops the watchdog observer."""
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+
+def quarantine(path, quarantine_dir):
+    """Moves a file that cannot be decided out of the source directory into `quarantine_dir`."""
+    dst = Path(quarantine_dir) / Path(path).name
+    try:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(path, dst)
+    except OSError as e:
+        LOGGER.error(f"Failed to quarantine {path}: {e}")
+    else:
+        LOGGER.warning(f"WARNING ⚠️ {path} could not be decided, moved to {dst}")
+
+
+def retry(files, kwargs, quarantine_dir):
+    """Decides the files of a failed micro-batch one at a time, skipping the ones the batch already recorded in the
+    manifest (resume), and quarantines the ones that fail again.
+    """
+    for path in files:
+        if not os.path.exists(path):  # 판정 후 --route move로 옮겨졌거나 삭제됨
+            LOGGER.info(f"{path} is no longer in the source directory, skipped")
+            continue
+        try:
+            predict8_ver4.run(source=[path], resume=True, append=True, **kwargs)
+        except Exception as e:
+            LOGGER.error(f"{path}: {e!r}")
+            quarantine(path, quarantine_dir)
+
+
+def run(
+    weights=ROOT / "yolov5l-seg.pt",  # seg model path(s)
+    face_weights=None,  # face model path(s), runs Process2 on Half crops in memory
+    source=ROOT / "data/images",  # directory to watch
+    process_dir=ROOT / "Process",  # Process1/Process2 output root (dirs and CSVs)
+    imgsz=(640, 640),  # inference size (height, width)
+    conf_thres=0.25,  # confidence threshold
+    iou_thres=0.45,  # NMS IOU threshold
+    face_conf_thres=0.25,  # face confidence threshold
+    device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+    half=False,  # use FP16 half-precision inference
+    dnn=False,  # use OpenCV DNN for ONNX inference
+    face_dnn=False,  # use OpenCV DNN for an ONNX face model
+    route="png",  # save unmodified originals as 'png', 'link' or 'move'
+    max_batch=16,  # maximum images per micro-batch
+    max_wait=0.5,  # seconds to wait for more images after the first ready one
+    settle=1.0,  # seconds without size/mtime change before a created/modified file is taken
+    poll=0.0,  # poll the directory every n seconds instead of inotify (0 = inotify when watchdog is installed)
+    catch_up=False,  # first decide the images already in the directory (like --resume, rebuilds the CSVs)
+    run_args=None,  # extra predict8_ver4.run keyword arguments, e.g. {"headless": true, "batch_size": 8}
+    project=ROOT / "runs/predict-seg",  # save results to project/name
+    name="watch",  # save results to project/name
+    max_batches=None,  # stop after this many micro-batches (None = run until interrupted)
+):
+    """Loads both models once and decides the images landing in `source` in micro-batches until interrupted."""
+    if (run_args or {}).get("save_parquet"):  # batch마다 Parquet 파일을 새로 쓰게 됨
+        raise ValueError("save_parquet is not supported in watch mode, rerun predict8_ver4.py --resume for Parquet")
+    if (run_args or {}).get("save_detections"):  # batch마다 전체 .npz를 읽고 다시 압축해서 씀
+        raise ValueError("save_detections is not supported in watch mode, run predict8_ver4.py --save-detections")
+    models = predict8_ver4.load_models(weights, face_weights, device, dnn, face_dnn, half=half)
+    kwargs = dict(run_args or {})
+    kwargs.update(weights=weights, face_weights=face_weights, imgsz=imgsz, conf_thres=conf_thres, iou_thres=iou_thres)
+    kwargs.update(face_conf_thres=face_conf_thres, half=half, dnn=dnn, face_dnn=face_dnn, device=device, route=route)
+    kwargs.update(process_dir=process_dir)
+    kwargs.update(project=project, name=name, exist_ok=True, workers=1, models=models)
+    for model in models:  # batch마다 하지 않고 한 번만
+        if model is not None:
+            model.warmup(imgsz=(1, 3, *imgsz))
+
+    watcher = SourceWatcher(source, settle, poll)
+    if catch_up and watcher.seen:
+        with watcher.lock:  # 시작 시점의 목록만, 그 사이 들어온 파일은 watcher가 처리
+            initial = [p for p in sorted(watcher.seen) if os.path.exists(p)]
+        LOGGER.info(f"Catching up on {len(initial)} images already in {source}")
+        try:
+            predict8_ver4.run(source=initial, resume=True, **kwargs)
+        except Exception as e:
+            LOGGER.error(f"Catch-up failed ({e!r}), retrying the images one at a time")
+            retry(initial, kwargs, Path(process_dir) / "quarantine")
+
+    batch, landed, batches = [], {}, 0
+    try:
+        while max_batches is None or batches < max_batches:
+            for path in watcher.ready():
+                batch.append(path)
+                landed[path] = time.monotonic()
+            if batch and (len(batch) >= max_batch or time.monotonic() - landed[batch[0]] >= max_wait):
+                todo, batch = batch[:max_batch], batch[max_batch:]
+                t = time.monotonic()
+                try:
+                    predict8_ver4.run(source=todo, append=True, **kwargs)
+                except Exception as e:  # 파일 하나 때문에 daemon이 멈추지 않도록
+                    LOGGER.error(f"Micro-batch of {len(todo)} images failed ({e!r}), retrying them one at a time")
+                    retry(todo, kwargs, Path(process_dir) / "quarantine")
+                done = time.monotonic()
+                latency = sorted(done - landed.pop(p) for p in todo)
+                LOGGER.info(
+                    f"{colorstr('bold', 'watch')}: {len(todo)} images in {done - t:.2f}s, latency from landing "
+                    f"median {latency[len(latency) // 2]:.2f}s, max {latency[-1]:.2f}s"
+                )
+                batches += 1
+            else:
+                time.sleep(0.02)
+    except KeyboardInterrupt:
+        LOGGER.info("Stopping, images still queued will be picked up with --catch-up")
+    finally:
+        watcher.close()
+
+
+def parse_opt():
+    """Parses command-line options for the watch daemon."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", type=str, default=ROOT / "yolov5l-seg.pt", help="seg model path(s)")
+    parser.add_argument("--face-weights", nargs="+", type=str, default=None, help="face model path(s)")
+    parser.add_argument("--source", type=str, default=ROOT / "data/images", help="directory to watch")
+    parser.add_argument("--process-dir", default=ROOT / "Process", help="Process1/Process2 output root")
+    parser.add_argument("--imgsz", "--img", "--img-size", nargs="+", type=int, default=[640], help="inference size h,w")
+    parser.add_argument("--conf-thres", type=float, default=0.25, help="confidence threshold")
+    parser.add_argument("--iou-thres", type=float, default=0.45, help="NMS IoU threshold")
+    parser.add_argument("--face-conf-thres", type=float, default=0.25, help="face confidence threshold")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
+    parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
+    parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
+    parser.add_argument("--face-dnn", action="store_true", help="use OpenCV DNN for an ONNX face model")
+    parser.add_argument("--route", default="png", choices=["png", "link", "move"], help="how to save originals")
+    parser.add_argument("--max-batch", type=int, default=16, help="maximum images per micro-batch")
+    parser.add_argument("--max-wait", type=float, default=0.5, help="seconds to wait for more images")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds without change before taking a file")
+    parser.add_argument("--poll", type=float, default=0.0, help="poll every n seconds instead of inotify")
+    parser.add_argument("--catch-up", action="store_true", help="first decide the images already in the directory")
+    parser.add_argument("--run-args", type=json.loads, default=None, help="extra predict8_ver4.run kwargs as JSON")
+    parser.add_argument("--project", default=ROOT / "runs/predict-seg", help="save results to project/name")
+    parser.add_argument("--name", default="watch", help="save results to project/name")
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    """Checks requirements once and runs the watch daemon."""
+    check_requirements(ROOT / "requirements.txt", exclude=("tensorboard", "thop"))
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)